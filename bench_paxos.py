@@ -0,0 +1,141 @@
+# This module provides simple allocation and memory benchmarks for the
+# composable_paxos classes. The slotted message and state classes are compared
+# against equivalent classes that use a regular per-instance __dict__ and the
+# cost of allocating a new PaxosInstance for each link in the multi-paxos
+# chain is compared against resetting and reusing an existing one. Finally, the
+# memory used per group and the cost of bulk operations are measured for an
+# AcceptorTable holding many independent Paxos groups.
+#
+# Usage: python bench_paxos.py [iterations] [groups]
+#
+import sys
+import time
+import timeit
+
+from composable_paxos import ProposalID, Prepare, Nack, Promise, Accept, Accepted, Resolution
+from composable_paxos import PaxosState, PaxosInstance, PaxosInstancePool, AcceptorTable
+
+
+PEERS = ['A', 'B', 'C']
+
+
+def unslotted(cls):
+    '''
+    Returns a copy of the message class that uses a __dict__ instead of __slots__
+    '''
+    return type('Dict' + cls.__name__, (object,), {'__init__' : cls.__dict__['__init__']})
+
+
+def object_size(obj):
+    '''
+    Returns the size in bytes of the object plus its __dict__ (if any) and any
+    sets or dictionaries it directly references
+    '''
+    total = sys.getsizeof(obj)
+
+    if hasattr(obj, '__dict__'):
+        total += sys.getsizeof(obj.__dict__)
+        attrs  = list(obj.__dict__.values())
+    else:
+        attrs  = [ getattr(obj, name, None) for name in PaxosState.__slots__ ]
+
+    for v in attrs:
+        if isinstance(v, (set, dict)):
+            total += sys.getsizeof(v)
+
+    return total
+
+
+def bench(label, fn, iterations):
+    elapsed = timeit.timeit(fn, number=iterations)
+    print '   {0:<34} {1:8.3f} us'.format(label, elapsed * 1e6 / iterations)
+
+
+def resolve(p):
+    '''
+    Runs a PaxosInstance through a complete, uncontested round of Paxos
+    '''
+    m = p.prepare()
+    for uid in PEERS:
+        p.receive_promise( Promise(uid, p.network_uid, m.proposal_id, None, None) )
+    p.propose_value('value')
+    for uid in PEERS:
+        p.receive_accepted( Accepted(uid, m.proposal_id, 'value') )
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    pid  = ProposalID(1, 'A')
+    args = { Prepare    : ('A', pid),
+             Nack       : ('A', 'B', pid, pid),
+             Promise    : ('A', 'B', pid, pid, 'value'),
+             Accept     : ('A', pid, 'value'),
+             Accepted   : ('A', pid, 'value'),
+             Resolution : ('A', 'value') }
+
+    print 'Message size (bytes): slotted / __dict__'
+    for cls in (Prepare, Nack, Promise, Accept, Accepted, Resolution):
+        a = args[cls]
+        print '   {0:<12} {1:5d} / {2:5d}'.format(cls.__name__, object_size(cls(*a)), object_size(unslotted(cls)(*a)))
+
+    print
+    print 'Message allocation:'
+    for cls in (Prepare, Accept, Accepted):
+        a  = args[cls]
+        dc = unslotted(cls)
+        bench(cls.__name__ + ' (slotted)',  lambda : cls(*a), iterations)
+        bench(cls.__name__ + ' (__dict__)', lambda : dc(*a),  iterations)
+
+    print
+    print 'PaxosInstance size (bytes):', object_size(PaxosInstance('A', 2))
+
+    pool  = PaxosInstancePool('A', 2)
+    reuse = PaxosInstance('A', 2)
+
+    def pooled():
+        p = pool.acquire()
+        resolve(p)
+        pool.release(p)
+
+    def reset():
+        reuse.reset()
+        resolve(reuse)
+
+    print
+    print 'Instance allocation:'
+    bench('PaxosInstance()',         lambda : PaxosInstance('A', 2), iterations)
+    bench('PaxosInstance.reset()',   lambda : reuse.reset(),         iterations)
+    print
+    print 'Full resolution per instance:'
+    bench('new PaxosInstance',       lambda : resolve(PaxosInstance('A', 2)), iterations)
+    bench('reset PaxosInstance',     reset,                                   iterations)
+    bench('PaxosInstancePool',       pooled,                                  iterations)
+
+    groups = int(sys.argv[2]) if len(sys.argv) > 2 else 500000
+    table  = AcceptorTable('A', PEERS, groups)
+
+    # One group in every hundred holds an accepted value
+    for group in xrange(0, groups, 100):
+        table.receive_accept(group, Accept('B', ProposalID(1, 'B'), 'value'))
+
+    print
+    print 'AcceptorTable with {0} groups:'.format(groups)
+    print '   {0:<34} {1:8.1f}'.format('Bytes per group', table.memory_usage() / float(groups))
+    print '   {0:<34} {1:8d}'.format('Bytes per PaxosInstance object', object_size(PaxosInstance('A', 2)))
+
+    def timed(label, fn):
+        start  = time.time()
+        result = fn()
+        print '   {0:<34} {1:8.3f} ms'.format(label, (time.time() - start) * 1e3)
+        return result
+
+    timed('promise_range() new master',       lambda : table.promise_range(0, groups, ProposalID(2, 'C')))
+    timed('promise_range() per-group path',   lambda : table.promise_range(0, groups, ProposalID(2, 'B')))
+    timed('uncommitted()',                    lambda : table.uncommitted())
+    timed('receive_accept() on every group',  lambda : [ table.receive_accept(g, Accept('C', ProposalID(2, 'C'), 'value'))
+                                                         for g in xrange(groups) ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+# This module replays a trace recorded by a server run with the --trace flag.
+# A ReplicatedValue is built from the requested strategy mixins, which default
+# to those of the recorded server, restored from the state, snapshot, log, and
+# membership files saved in the trace, and fed the recorded messages and
+# timer firings in their original order as quickly as possible. No packets are
+# sent and no timers run on their own. The number of messages of each type sent
+# by the replayed server is compared against the number that were recorded.
+#
+# The CPU time spent handling each type of message and each timer is reported
+# along with the decisions, the new links in the multi-paxos chain, reached by
+# the replayed server. Replaying the same trace against different strategy
+# mixes, or against modified versions of them, allows changes to be
+# benchmarked against real traffic.
+#
+# Timers are identified by the location of the function they call. When the
+# trace records a timer firing, the earliest scheduled and still active timer
+# with the same label is fired. Behavior that depends on the wall clock, such
+# as the lease renewal delay or the response latencies measured by the thrifty
+# strategy, may differ from that of the recorded server.
+#
+# Usage: python bench_replay.py [--mixins plain|master|Mixin,Mixin,...] [--thrifty|--no-thrifty]
+#                               [--decisions] [--verbose] <trace_file>
+#
+import sys
+import time
+import base64
+import shutil
+import os.path
+import argparse
+import tempfile
+import collections
+
+import runtime
+
+from message_trace       import TraceReader, timer_label, parse_addr, RECEIVE, CLIENT, SEND, TIMER
+from replicated_value    import BaseReplicatedValue
+from messenger           import Messenger
+from sync_strategy       import SimpleSynchronizationStrategyMixin
+from resolution_strategy import ExponentialBackoffResolutionStrategyMixin
+from master_strategy     import DedicatedMasterStrategyMixin
+from learner_strategy    import LearnerPublisherMixin, LearnerReplicaMixin
+from membership_strategy import ReconfigurationStrategyMixin
+from delta_strategy      import DeltaStrategyMixin
+from state_machine       import StateMachineMixin
+from snapshot_strategy   import SnapshotStrategyMixin
+from thrifty_strategy    import ThriftyAcceptStrategyMixin
+from kv_store            import KeyValueStore
+
+
+MIXINS = dict( (cls.__name__, cls) for cls in (SimpleSynchronizationStrategyMixin,
+                                               ExponentialBackoffResolutionStrategyMixin,
+                                               DedicatedMasterStrategyMixin,
+                                               LearnerPublisherMixin,
+                                               LearnerReplicaMixin,
+                                               ReconfigurationStrategyMixin,
+                                               DeltaStrategyMixin,
+                                               StateMachineMixin,
+                                               SnapshotStrategyMixin,
+                                               ThriftyAcceptStrategyMixin) )
+
+# The strategy mixes used by server.py without the --kv flag
+PRESETS = dict( plain  = 'ReconfigurationStrategyMixin,DeltaStrategyMixin,ExponentialBackoffResolutionStrategyMixin,'
+                         'ThriftyAcceptStrategyMixin,LearnerPublisherMixin,SimpleSynchronizationStrategyMixin',
+                master = 'DedicatedMasterStrategyMixin,ReconfigurationStrategyMixin,DeltaStrategyMixin,'
+                         'ExponentialBackoffResolutionStrategyMixin,ThriftyAcceptStrategyMixin,LearnerPublisherMixin,'
+                         'SimpleSynchronizationStrategyMixin' )
+
+
+class ReplayTimer (object):
+
+    def __init__(self, rt, label, fn, args, looping):
+        self.rt      = rt
+        self.label   = label
+        self.fn      = fn
+        self.args    = args
+        self.looping = looping
+        self.live    = True
+        rt.pending[label].append(self)
+
+    def fire(self):
+        if not self.looping:
+            self.live = False
+        self.fn(*self.args)
+
+    def active(self):
+        return self.live
+
+    def cancel(self):
+        self.live = False
+
+    stop = cancel
+
+
+
+class ReplayTransport (object):
+
+    def __init__(self):
+        self.sent = list()
+
+    def write(self, packet, addr):
+        self.sent.append( (addr, packet) )
+
+
+
+class ReplayRuntime (object):
+    '''
+    Runtime in which timers fire only when the trace says they did
+    '''
+
+    def __init__(self):
+        self.pending   = collections.defaultdict(list) # label => list of ReplayTimer
+        self.transport = ReplayTransport()
+
+    def call_later(self, delay, fn, *args):
+        return ReplayTimer(self, timer_label(fn), fn, args, False)
+
+    def looping_call(self, interval, fn, now=True):
+        t = ReplayTimer(self, timer_label(fn), fn, (), True)
+        if now:
+            fn() # The initial call is not recorded as a timer firing. See TracingRuntime
+        return t
+
+    def listen_udp(self, port, proto):
+        proto.transport = self.transport
+        proto.startProtocol()
+
+    def listen_tcp(self, port, proto_factory):
+        pass
+
+    def connect_tcp(self, host, port, proto):
+        pass
+
+    def fire(self, label):
+        '''
+        Fires the earliest active timer with the label. Returns False if there
+        is none.
+        '''
+        l = self.pending.get(label, ())
+        while l and not l[0].live:
+            l.pop(0)
+        if not l:
+            return False
+        l[0].fire()
+        return True
+
+
+
+def recorded_mixins(header):
+    '''
+    Returns the names of the strategy mixins used by the recorded server.
+    Classes that only combine other mixins, such as the UpdateStrategyMixin
+    defined by server.py, are followed by their bases in the recorded order
+    and are omitted.
+    '''
+    return [ name for name in header['mixins'] if name in MIXINS ]
+
+
+def build_replicated_value(mixin_names, header, state_file, thrifty):
+    '''
+    mixin_names is a preset name, a comma-separated list of mixin class names,
+    or None for the mixins of the recorded server. thrifty defaults to the
+    recorded setting if it is None.
+    '''
+    if mixin_names is None:
+        names = recorded_mixins(header)
+    else:
+        names = PRESETS.get(mixin_names, mixin_names).split(',')
+
+    if thrifty is None:
+        thrifty = header['settings'].get('thrifty', False)
+
+    cls = type('ReplicatedValue', tuple( MIXINS[name] for name in names ) + (BaseReplicatedValue,),
+               dict( learners            = header['learners'],
+                     thrifty             = thrifty,
+                     state_machine_class = KeyValueStore ))
+
+    for suffix, data in header['files'].items():
+        with open(state_file + suffix, 'wb') as f:
+            f.write( base64.b64decode(data) )
+
+    return cls(header['uid'], header['peers'], state_file, header['quorum_size'], header['accept_quorum_size'])
+
+
+
+def replay(trace_file, mixin_names, thrifty, verbose):
+    reader = TraceReader(trace_file)
+    header = reader.header
+    rt     = ReplayRuntime()
+    tmpdir = tempfile.mkdtemp()
+
+    runtime.install(rt)
+
+    cpu       = collections.defaultdict(float) # handler => CPU seconds
+    calls     = collections.defaultdict(int)   # handler => number of calls
+    recorded  = collections.defaultdict(int)   # message type => number recorded as sent
+    decisions = list()                         # (instance_number, current_value)
+    unmatched = 0
+    events    = 0
+
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w') # The servers print every message
+
+    try:
+        r     = build_replicated_value(mixin_names, header, os.path.join(tmpdir, header['uid'] + '.json'), thrifty)
+        addrs = dict( (uid, tuple(addr)) for uid, addr in header['addrs'].items() )
+        m     = Messenger(header['uid'], addrs, r, None, header['value_cache_size'])
+
+        instance_number = r.instance_number
+        clock           = time.clock
+        wall_start      = time.time()
+
+        for kind, timestamp, payload in reader:
+            if kind == SEND:
+                recorded[ payload.split('\x00', 1)[1].split(' ', 1)[0] ] += 1
+                continue
+
+            start = clock()
+
+            if kind == RECEIVE:
+                from_uid, packet = payload.split('\x00', 1)
+                handler = 'receive_' + packet.split(' ', 1)[0]
+                m.streamReceived(from_uid, packet)
+
+            elif kind == CLIENT:
+                from_addr, packet = payload.split('\x00', 1)
+                handler = 'client ' + packet.split(' ', 1)[0]
+                m.datagramReceived(packet, parse_addr(from_addr))
+
+            elif kind == TIMER:
+                handler = 'timer ' + payload
+                if not rt.fire(payload):
+                    unmatched += 1
+
+            else:
+                continue
+
+            cpu[handler]   += clock() - start
+            calls[handler] += 1
+            events         += 1
+
+            if r.instance_number != instance_number:
+                instance_number = r.instance_number
+                decisions.append( (instance_number, r.current_value) )
+
+        wall = time.time() - wall_start
+
+    finally:
+        sys.stdout = sys.__stdout__
+        shutil.rmtree(tmpdir)
+
+    replayed = collections.defaultdict(int)
+    for addr, packet in rt.transport.sent:
+        replayed[ packet.split(' ', 1)[0] ] += 1
+
+    return dict( mixins    = [ cls.__name__ for cls in type(r).__bases__[:-1] ],
+                 thrifty   = isinstance(r, ThriftyAcceptStrategyMixin) and r.thrifty,
+                 events    = events,
+                 wall      = wall,
+                 cpu       = cpu,
+                 calls     = calls,
+                 decisions = decisions,
+                 unmatched = unmatched,
+                 recorded  = recorded,
+                 replayed  = replayed )
+
+
+
+def main():
+    p = argparse.ArgumentParser(description='Replays a trace recorded by server.py --trace and reports the CPU time spent in each handler')
+    p.add_argument('trace_file')
+    p.add_argument('--mixins', help='Comma-separated strategy mixin class names, in inheritance order, or one of: ' + ', '.join(sorted(PRESETS.keys())) + '. Defaults to the mixins of the recorded server')
+    p.add_argument('--thrifty', action='store_true', default=None, help='Enables thrifty Accept messaging if ThriftyAcceptStrategyMixin is included. Defaults to the recorded setting')
+    p.add_argument('--no-thrifty', dest='thrifty', action='store_false', help='Disables thrifty Accept messaging')
+    p.add_argument('--decisions', action='store_true', help='Lists each decision reached')
+    p.add_argument('--verbose', action='store_true', help='Shows the output of the replayed server. The time spent printing is included in the handler CPU times')
+
+    args = p.parse_args()
+
+    result = replay(args.trace_file, args.mixins, args.thrifty, args.verbose)
+
+    total = sum(result['cpu'].values())
+
+    print 'Mixins: {0}{1}'.format(', '.join(result['mixins']), ' (thrifty)' if result['thrifty'] else '')
+    print 'Replayed {0} events in {1:.3f} seconds ({2:.3f} seconds of handler CPU time)'.format(result['events'], result['wall'], total)
+    print
+    print '   {0:<56} {1:>8} {2:>10} {3:>10}'.format('Handler', 'Calls', 'CPU ms', 'us/call')
+
+    for handler, t in sorted(result['cpu'].items(), key = lambda x: -x[1]):
+        n = result['calls'][handler]
+        print '   {0:<56} {1:>8} {2:>10.3f} {3:>10.2f}'.format(handler, n, t * 1e3, t * 1e6 / n)
+
+    print
+    print 'Decisions:', len(result['decisions'])
+
+    if result['decisions']:
+        first, last = result['decisions'][0], result['decisions'][-1]
+        print '   Instances {0} through {1}. Final value: {2}'.format(first[0], last[0], repr(last[1])[:60])
+
+    if args.decisions:
+        for instance_number, value in result['decisions']:
+            print '   {0:>8} {1}'.format(instance_number, repr(value)[:60])
+
+    print
+    print '   {0:<20} {1:>10} {2:>10}'.format('Messages sent', 'Recorded', 'Replayed')
+
+    for message_type in sorted(set(result['recorded']) | set(result['replayed'])):
+        print '   {0:<20} {1:>10} {2:>10}'.format(message_type, result['recorded'][message_type], result['replayed'][message_type])
+
+    if result['unmatched']:
+        print
+        print 'Timer firings with no matching timer:', result['unmatched']
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# This module measures the per-packet overhead of the event loop runtimes
+# defined in runtime.py. Two UDP endpoints on the loopback interface bounce a
+# packet back and forth for a fixed number of round trips and the average
+# time per packet is reported. A timer is also rescheduled on every packet to
+# approximate the timer churn caused by the resolution strategy.
+#
+# Usage: python bench_runtime.py <twisted|asyncio> [round_trips]
+#
+import sys
+import time
+
+import runtime
+
+
+BASE_PORT = 7411
+
+
+class PingPong (object):
+
+    def __init__(self, port, peer_port, round_trips, initiator):
+        self.peer        = ('127.0.0.1', peer_port)
+        self.round_trips = round_trips
+        self.initiator   = initiator
+        self.count       = 0
+        self.timer       = None
+        runtime.listen_udp(port, self)
+
+    def startProtocol(self):
+        pass
+
+    def start(self):
+        self.start_time = time.time()
+        self.transport.write(b'ping ' + b'x' * 64, self.peer)
+
+    def datagramReceived(self, packet, from_addr):
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = runtime.call_later(10.0, lambda : None)
+
+        if self.initiator:
+            self.count += 1
+            if self.count == self.round_trips:
+                elapsed = time.time() - self.start_time
+                print('{0} packets in {1:.3f} seconds: {2:.2f} us/packet'.format(self.round_trips * 2, elapsed,
+                                                                              elapsed * 1e6 / (self.round_trips * 2)))
+                self.timer.cancel()
+                runtime.stop()
+                return
+
+        self.transport.write(packet, from_addr)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in runtime.runtimes:
+        print('python bench_runtime.py <{0}> [round_trips]'.format('|'.join(sorted(runtime.runtimes.keys()))))
+        sys.exit(1)
+
+    round_trips = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    runtime.install( runtime.runtimes[sys.argv[1]]() )
+
+    PingPong(BASE_PORT + 1, BASE_PORT, round_trips, False)
+    a = PingPong(BASE_PORT, BASE_PORT + 1, round_trips, True)
+
+    runtime.call_later(0, a.start)
+    runtime.run()
+
+
+if __name__ == '__main__':
+    main()
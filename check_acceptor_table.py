@@ -0,0 +1,111 @@
+# This module checks that an AcceptorTable behaves exactly like a collection of
+# independent Acceptor instances. A random sequence of Prepare and Accept
+# messages, commits, range promises, and scans for uncommitted groups is applied
+# both to a table and to one Acceptor per group. Every reply and the state of
+# each group must match. Proposal numbers are kept small and UIDs are drawn from
+# a mix of known and unknown peers so that ties, rejections, and the insertion of
+# new UIDs into the table's rank ordering are all exercised.
+#
+# Usage: python check_acceptor_table.py [steps] [seed]
+#
+import sys
+import random
+
+from composable_paxos import ProposalID, Prepare, Accept, Acceptor, AcceptorTable
+
+
+GROUPS = 50
+UIDS   = 'ABCDEFGH'
+
+
+def same_reply(table_reply, acceptor_reply):
+    if type(table_reply) is not type(acceptor_reply):
+        raise AssertionError('Reply type mismatch: {0} != {1}'.format(table_reply, acceptor_reply))
+
+    for name in type(acceptor_reply).__slots__ + ['from_uid']:
+        if getattr(table_reply, name) != getattr(acceptor_reply, name):
+            raise AssertionError('Reply {0} mismatch: {1} != {2}'.format(name, getattr(table_reply, name),
+                                                                         getattr(acceptor_reply, name)))
+
+
+def group_state(table, group):
+    return table.promised_id(group), table.accepted_id(group), table.accepted_value(group)
+
+
+def acceptor_state(acceptor):
+    return acceptor.promised_id, acceptor.accepted_id, acceptor.accepted_value
+
+
+def check(steps, seed):
+    rnd       = random.Random(seed)
+    table     = AcceptorTable('A', 'BDF', GROUPS)
+    acceptors = [ Acceptor('A') for i in range(GROUPS) ]
+    instances = [ 0 ] * GROUPS
+
+    for step in xrange(steps):
+        group = rnd.randrange(GROUPS)
+        pid   = ProposalID(rnd.randrange(6), rnd.choice(UIDS))
+        op    = rnd.random()
+
+        if op < 0.35:
+            same_reply( table.receive_prepare(group, Prepare(pid.uid, pid)),
+                        acceptors[group].receive_prepare(Prepare(pid.uid, pid)) )
+
+        elif op < 0.7:
+            value = 'v{0}'.format(step)
+            same_reply( table.receive_accept(group, Accept(pid.uid, pid, value)),
+                        acceptors[group].receive_accept(Accept(pid.uid, pid, value)) )
+
+        elif op < 0.8:
+            # Promises carry over to the next instance. Accepted values do not
+            table.commit(group)
+            instances[group] += 1
+            acceptors[group]._reset_acceptor(acceptors[group].promised_id, None, None)
+
+        elif op < 0.9:
+            start    = rnd.randrange(GROUPS)
+            stop     = rnd.randrange(start, GROUPS + 1)
+            expected = list()
+
+            for g in range(start, stop):
+                if pid >= acceptors[g].promised_id:
+                    acceptors[g].promised_id = pid
+                else:
+                    expected.append(g)
+
+            rejected = table.promise_range(start, stop, pid)
+
+            if rejected != expected:
+                raise AssertionError('promise_range({0}, {1}) rejected {2}, expected {3}'.format(start, stop,
+                                                                                                 rejected, expected))
+        else:
+            start    = rnd.randrange(GROUPS)
+            expected = [ g for g in range(start, GROUPS) if acceptors[g].accepted_id is not None ]
+
+            if table.uncommitted(start) != expected:
+                raise AssertionError('uncommitted({0}) mismatch'.format(start))
+
+        if group_state(table, group) != acceptor_state(acceptors[group]):
+            raise AssertionError('Step {0}: group {1} state {2} != {3}'.format(step, group, group_state(table, group),
+                                                                               acceptor_state(acceptors[group])))
+
+    for g in range(GROUPS):
+        if group_state(table, g) + (table.instance_number(g),) != acceptor_state(acceptors[g]) + (instances[g],):
+            raise AssertionError('Final state mismatch for group {0}'.format(g))
+
+    return table
+
+
+
+def main():
+    steps = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    seed  = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    table = check(steps, seed)
+
+    print 'AcceptorTable matched Acceptor for {0} steps across {1} groups (seed {2}, {3} known UIDs)'.format(steps, GROUPS, seed,
+                                                                                                         len(table.uids))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,31 @@
 # when master leases are in use, requests must be sent to the current master
 # server. All non-master servers will ignore the requests since they do not have
 # the ability to propose new values in the multi-paxos chain.
+#
+# If the new value is omitted, the client will instead read the current value
+# from the server. Reads may be sent to any peer or learner replica and the
+# reply includes the staleness bound reported by the server, if one is known.
+#
+# The --reconfigure option requests a change to the membership of the chain.
+# The file uses the same format as the configuration files accepted by
+# config.load(). Only the peers and quorum sizes are used.
+#
+# The --patch option requests that the <length> characters of the current value
+# starting at <offset> be replaced by the new value rather than replacing the
+# entire value.
+#
+# When the servers replicate a key-value store, the --command option submits the
+# new value as a JSON-encoded batch of operations and the --query option sends
+# the new value as a JSON-encoded query and prints the result. See kv_store.py
+# for the formats.
+#
+# The --profile option starts or stops a profiler in the running server. The
+# optional mode is 'sample', the default, or 'handlers'. The server replies
+# with the profilers that are running and the collapsed stack files written by
+# those that were stopped. See profiling.py.
 
 import sys
+import json
 
 from twisted.internet import reactor, defer, protocol
 
@@ -13,24 +36,92 @@ import config
 
 class ClientProtocol(protocol.DatagramProtocol):
 
+    read_timeout = 2.0 # seconds
+
     def __init__(self, uid, new_value):
-        self.addr      = config.peers[uid]
+        self.addr      = config.all_nodes()[uid]
         self.new_value = new_value
 
     def startProtocol(self):
-        self.transport.write('propose {0}'.format(self.new_value), self.addr)
+        if profile_action is not None:
+            self.transport.write('profile {0}'.format(json.dumps(dict(action = profile_action,
+                                                                      mode   = self.new_value))), self.addr)
+            self.timeout = reactor.callLater(self.read_timeout, self.timed_out)
+        elif reconfigure_file is not None:
+            with open(reconfigure_file) as f:
+                self.transport.write('reconfigure {0}'.format(f.read()), self.addr)
+            reactor.stop()
+        elif patch is not None:
+            self.transport.write('patch {0}'.format(json.dumps([[patch[0], patch[1], self.new_value]])), self.addr)
+            reactor.stop()
+        elif kv_mode == 'command':
+            self.transport.write('command {0}'.format(self.new_value), self.addr)
+            reactor.stop()
+        elif kv_mode == 'query':
+            self.transport.write('query {0}'.format(self.new_value), self.addr)
+            self.timeout = reactor.callLater(self.read_timeout, self.timed_out)
+        elif self.new_value is None:
+            self.transport.write('read ', self.addr)
+            self.timeout = reactor.callLater(self.read_timeout, self.timed_out)
+        else:
+            self.transport.write('propose {0}'.format(self.new_value), self.addr)
+            reactor.stop()
+
+    def datagramReceived(self, packet, from_addr):
+        self.timeout.cancel()
+        message_type, data = packet.split(' ', 1)
+        m = json.loads(data)
+        if message_type == 'profile':
+            print json.dumps(m, indent=2, sort_keys=True)
+            reactor.stop()
+            return
+        print 'Instance: ', m['instance_number']
+        if message_type == 'result':
+            print 'Result:   ', json.dumps(m['result'], indent=2, sort_keys=True)
+        else:
+            print 'Value:    ', m['current_value']
+        print 'Staleness:', 'unknown' if m['staleness'] is None else '{0:.3f} seconds'.format(m['staleness'])
+        reactor.stop()
+
+    def timed_out(self):
+        print 'No reply received'
         reactor.stop()
 
 
-if len(sys.argv) != 3 or not  sys.argv[1] in config.peers:
-    print 'python client.py <A|B|C> <new_value>'
+args             = sys.argv[1:]
+reconfigure_file = None
+patch            = None
+kv_mode          = None
+profile_action   = None
+
+if len(args) > 1 and args[0] == '--config':
+    config.load(args[1])
+    args = args[2:]
+
+if len(args) > 1 and args[0] == '--reconfigure':
+    reconfigure_file = args[1]
+    args = args[2:]
+
+if len(args) > 2 and args[0] == '--patch':
+    patch = (int(args[1]), int(args[2]))
+    args = args[3:]
+
+if len(args) > 0 and args[0] in ('--command', '--query'):
+    kv_mode = args[0][2:]
+    args = args[1:]
+
+if len(args) > 1 and args[0] == '--profile' and args[1] in ('start', 'stop'):
+    profile_action = args[1]
+    args = args[2:]
+
+if not len(args) in (1,2) or not args[0] in config.all_nodes() or ((patch or kv_mode) is not None and len(args) != 2):
+    print 'python client.py [--config <file>] [--reconfigure <file>] [--patch <offset> <length>] [--command|--query] [--profile <start|stop>] <{0}> [new_value|profile_mode]'.format('|'.join(sorted(config.all_nodes().keys())))
     sys.exit(1)
 
-    
+
 def main():
-    reactor.listenUDP(0,ClientProtocol(sys.argv[1], sys.argv[2]))
+    reactor.listenUDP(0,ClientProtocol(args[0], args[1] if len(args) == 2 else None))
+
 
-    
 reactor.callWhenRunning(main)
 reactor.run()
-
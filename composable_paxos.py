@@ -3,6 +3,9 @@ This module provides an implementation of the Paxos algorithm as
 a set of composable classes. 
 '''
 
+import sys
+import array
+import bisect
 import collections
 
 # ProposalID
@@ -25,17 +28,32 @@ ProposalID = collections.namedtuple('ProposalID', ['number', 'uid'])
 
 
 
+def peer_bits(uids):
+    '''
+    Returns a dictionary that maps each of the provided peer UIDs to a unique,
+    single-bit integer. Quorums are tracked as the bitwise OR of these values
+    which avoids the overhead of maintaining sets of UIDs for every message
+    received. Sorting the UIDs ensures that all peers use the same mapping.
+    '''
+    return dict( (uid, 1 << i) for i, uid in enumerate(sorted(uids)) )
+
+
+
 class PaxosMessage (object):
     '''
-    Base class for all messages defined in this module
+    Base class for all messages defined in this module. Messages are created
+    for every packet sent and received so all message classes use __slots__
+    to avoid the overhead of a per-instance __dict__.
     '''
-    from_uid = None # Set by subclass constructor
+    __slots__ = ['from_uid'] # Set by subclass constructor
 
     
 class Prepare (PaxosMessage):
     '''
     Prepare messages should be broadcast to all Acceptors.
     '''
+    __slots__ = ['proposal_id']
+    
     def __init__(self, from_uid, proposal_id):
         self.from_uid    = from_uid
         self.proposal_id = proposal_id
@@ -49,6 +67,8 @@ class Nack (PaxosMessage):
     chosen. NACKs may be sent in response to both Prepare and Accept
     messages
     '''
+    __slots__ = ['proposal_id', 'proposer_uid', 'promised_proposal_id']
+    
     def __init__(self, from_uid, proposer_uid, proposal_id, promised_proposal_id):
         self.from_uid             = from_uid
         self.proposal_id          = proposal_id
@@ -61,6 +81,8 @@ class Promise (PaxosMessage):
     Promise messages should be sent to at least the Proposer specified in
     the proposer_uid field
     '''
+    __slots__ = ['proposer_uid', 'proposal_id', 'last_accepted_id', 'last_accepted_value']
+    
     def __init__(self, from_uid, proposer_uid, proposal_id, last_accepted_id, last_accepted_value):
         self.from_uid             = from_uid
         self.proposer_uid         = proposer_uid
@@ -73,6 +95,8 @@ class Accept (PaxosMessage):
     '''
     Accept messages should be broadcast to all Acceptors
     '''
+    __slots__ = ['proposal_id', 'proposal_value']
+    
     def __init__(self, from_uid, proposal_id, proposal_value):
         self.from_uid       = from_uid
         self.proposal_id    = proposal_id
@@ -83,6 +107,8 @@ class Accepted (PaxosMessage):
     '''
     Accepted messages should be sent to all Learners
     '''
+    __slots__ = ['proposal_id', 'proposal_value']
+    
     def __init__(self, from_uid, proposal_id, proposal_value):
         self.from_uid       = from_uid
         self.proposal_id    = proposal_id
@@ -93,6 +119,8 @@ class Resolution (PaxosMessage):
     '''
     Optional message used to indicate that the final value has been selected
     '''
+    __slots__ = ['value']
+    
     def __init__(self, from_uid, value):
         self.from_uid = from_uid
         self.value    = value
@@ -107,6 +135,7 @@ class InvalidMessageError (Exception):
 
     
 class MessageHandler (object):
+    __slots__ = ()
 
     def receive(self, msg):
         '''
@@ -118,31 +147,90 @@ class MessageHandler (object):
             raise InvalidMessageError('Receiving class does not support messages of type: ' + msg.__class__.__name__)
         return handler( msg )
 
+
+
+class PaxosState (MessageHandler):
+    '''
+    Python does not allow a class to inherit from more than one base class
+    that defines a non-empty __slots__ declaration. As the Proposer, Acceptor,
+    and Learner classes are intended to be composed together (see
+    PaxosInstance), the slots for all three roles are declared here in a single,
+    common base class.
+
+    The Proposer and Learner track the peers that have responded to them as
+    integer bitmasks. The uid_bits dictionary maps each peer UID to its bit and
+    may be shared between all instances on a node (see peer_bits()). UIDs
+    missing from the dictionary are assigned the next free bit when first seen.
+    '''
+    __slots__ = ['network_uid', 'quorum_size', 'accept_quorum_size', 'uid_bits',
+                 # Proposer
+                 'leader', 'proposed_value', 'proposal_id', 'highest_proposal_id',
+                 'highest_accepted_id', 'promises_mask', 'promises_count',
+                 'nacks_mask', 'nacks_count', 'current_prepare_msg', 'current_accept_msg',
+                 # Acceptor
+                 'promised_id', 'accepted_id', 'accepted_value',
+                 # Learner
+                 'proposals', 'acceptors', 'last_proposal_id', 'last_proposal',
+                 'final_value', 'final_acceptor_mask', 'final_proposal_id']
+
+
+    def _init_uid_bits(self, uid_bits):
+        self.uid_bits = uid_bits if uid_bits is not None else dict()
+
+        
+    def peer_bit(self, uid):
+        '''
+        Returns the bit assigned to the provided peer UID
+        '''
+        bit = self.uid_bits.get(uid)
+        if bit is None:
+            bit = 1 << len(self.uid_bits)
+            self.uid_bits[uid] = bit
+        return bit
+
+
+    def uids_in_mask(self, mask):
+        '''
+        Returns the set of peer UIDs that have their bit set in the provided mask
+        '''
+        return set( uid for uid, bit in self.uid_bits.items() if mask & bit )
+
     
         
-class Proposer (MessageHandler):
+class Proposer (PaxosState):
     '''
     The 'leader' attribute is a boolean value indicating the Proposer's
     belief in whether or not it is the current leader. This is not a reliable
     value as multiple nodes may simultaneously believe themselves to be the
     leader. 
-    '''
-    
-    leader               = False
-    proposed_value       = None
-    proposal_id          = None
-    highest_accepted_id  = None
-    promises_received    = None
-    nacks_received       = None
-    current_prepare_msg  = None
-    current_accept_msg   = None
 
+    The peers from which Promise and Nack messages have been received for the
+    current proposal are tracked in the promises_mask and nacks_mask bitmasks.
+    '''
+    __slots__ = ()
     
-    def __init__(self, network_uid, quorum_size):
+    def __init__(self, network_uid, quorum_size, uid_bits=None):
         self.network_uid         = network_uid
         self.quorum_size         = quorum_size
-        self.proposal_id         = ProposalID(0, network_uid)
-        self.highest_proposal_id = ProposalID(0, network_uid)
+        self._init_uid_bits(uid_bits)
+        self._reset_proposer()
+
+
+    def _reset_proposer(self):
+        '''
+        Returns the Proposer to its initial state
+        '''
+        self.leader              = False
+        self.proposed_value      = None
+        self.proposal_id         = ProposalID(0, self.network_uid)
+        self.highest_proposal_id = self.proposal_id
+        self.highest_accepted_id = None
+        self.current_prepare_msg = None
+        self.current_accept_msg  = None
+        self.promises_mask       = 0
+        self.promises_count      = 0
+        self.nacks_mask          = 0
+        self.nacks_count         = 0
 
     
     def propose_value(self, value):
@@ -167,14 +255,31 @@ class Proposer (MessageHandler):
         '''
 
         self.leader              = False
-        self.promises_received   = set()
-        self.nacks_received      = set()
         self.proposal_id         = ProposalID(self.highest_proposal_id.number + 1, self.network_uid)
         self.highest_proposal_id = self.proposal_id
         self.current_prepare_msg = Prepare(self.network_uid, self.proposal_id)
+        self.promises_mask       = 0
+        self.promises_count      = 0
+        self.nacks_mask          = 0
+        self.nacks_count         = 0
 
         return self.current_prepare_msg
 
+
+    def resume_leadership(self, proposal_id):
+        '''
+        Assumes leadership for proposal_id without a Prepare/Promise round.
+        Multi-paxos implementations may call this on a newly reset instance
+        when the Promises received for proposal_id in an earlier instance also
+        apply to all subsequent instances. This is only safe if a quorum of
+        Acceptors has promised proposal_id for this instance and none of them
+        can have accepted a value in it.
+        '''
+        self.observe_proposal( proposal_id )
+        
+        self.leader      = True
+        self.proposal_id = proposal_id
+
     
     def observe_proposal(self, proposal_id):
         '''
@@ -196,11 +301,15 @@ class Proposer (MessageHandler):
         '''
         self.observe_proposal( msg.promised_proposal_id )
         
-        if msg.proposal_id == self.proposal_id and self.nacks_received is not None:
-            self.nacks_received.add( msg.from_uid )
+        if msg.proposal_id == self.proposal_id:
+            bit = self.peer_bit( msg.from_uid )
+
+            if not self.nacks_mask & bit:
+                self.nacks_mask  |= bit
+                self.nacks_count += 1
 
-            if len(self.nacks_received) == self.quorum_size:
-                return self.prepare() # Lost leadership or failed to acquire it
+                if self.nacks_count == self.quorum_size:
+                    return self.prepare() # Lost leadership or failed to acquire it
 
 
     def receive_promise(self, msg):
@@ -209,16 +318,22 @@ class Proposer (MessageHandler):
         '''
         self.observe_proposal( msg.proposal_id )
 
-        if not self.leader and msg.proposal_id == self.proposal_id and msg.from_uid not in self.promises_received:
+        if self.leader or msg.proposal_id != self.proposal_id:
+            return
+
+        bit = self.peer_bit( msg.from_uid )
+
+        if not self.promises_mask & bit:
 
-            self.promises_received.add( msg.from_uid )
+            self.promises_mask  |= bit
+            self.promises_count += 1
 
             if msg.last_accepted_id > self.highest_accepted_id:
                 self.highest_accepted_id = msg.last_accepted_id
                 if msg.last_accepted_value is not None:
                     self.proposed_value = msg.last_accepted_value
 
-            if len(self.promises_received) == self.quorum_size:
+            if self.promises_count == self.quorum_size:
                 self.leader = True
 
                 if self.proposed_value is not None:
@@ -227,7 +342,7 @@ class Proposer (MessageHandler):
 
 
                 
-class Acceptor (MessageHandler):
+class Acceptor (PaxosState):
     '''
     Acceptors act as the fault-tolerant memory for Paxos. To ensure correctness
     in the presense of failure, Acceptors must be able to remember the promises
@@ -239,6 +354,7 @@ class Acceptor (MessageHandler):
     is generally advantageous to call the proposer's observe_proposal()
     method when methods of this class are called.
     '''
+    __slots__ = ()
 
     def __init__(self, network_uid, promised_id=None, accepted_id=None, accepted_value=None):
         '''
@@ -246,6 +362,10 @@ class Acceptor (MessageHandler):
         instance is recovering from persistent state.
         '''
         self.network_uid    = network_uid
+        self._reset_acceptor(promised_id, accepted_id, accepted_value)
+
+
+    def _reset_acceptor(self, promised_id=None, accepted_id=None, accepted_value=None):
         self.promised_id    = promised_id
         self.accepted_id    = accepted_id
         self.accepted_value = accepted_value
@@ -279,28 +399,64 @@ class Acceptor (MessageHandler):
 
 
         
-class Learner (MessageHandler):
+class Learner (PaxosState):
     '''
     This class listens to Accepted messages, determines when the final value is
     selected, and tracks which peers have accepted the final value.
+
+    The number of Accepted messages required to select the final value is held
+    in the accept_quorum_size attribute. It need not be the same as the
+    quorum_size used by Proposers for Promise messages. Any sizes may be used
+    so long as the sum of the two is greater than the number of acceptors.
+
+    Each proposal tracks the peers that have accepted it as a bitmask. In the
+    common case, all Accepted messages for an instance name the same proposal
+    so the most recently used ProposalStatus is cached to avoid a dictionary
+    lookup for each message. A ProposalStatus object is only allocated the
+    first time a proposal is seen.
     '''
+    __slots__ = ()
+    
     class ProposalStatus (object):
-        __slots__ = ['accept_count', 'retain_count', 'acceptors', 'value']
+        __slots__ = ['accept_count', 'accept_mask', 'retain_mask', 'value']
         def __init__(self, value):
             self.accept_count = 0
-            self.retain_count = 0
-            self.acceptors    = set()
+            self.accept_mask  = 0 # Peers that have ever accepted the proposal
+            self.retain_mask  = 0 # Peers for which this is the most recently accepted proposal
             self.value        = value
 
             
-    def __init__(self, network_uid, quorum_size):
-        self.network_uid       = network_uid
-        self.quorum_size       = quorum_size
+    def __init__(self, network_uid, accept_quorum_size, uid_bits=None):
+        self.network_uid        = network_uid
+        self.accept_quorum_size = accept_quorum_size
         self.proposals         = dict() # maps proposal_id => ProposalStatus
         self.acceptors         = dict() # maps from_uid => last_accepted_proposal_id
-        self.final_value       = None
-        self.final_acceptors   = None   # Will be a set of acceptor UIDs once the final value is chosen
-        self.final_proposal_id = None
+        self._init_uid_bits(uid_bits)
+        self._reset_learner()
+
+
+    def _reset_learner(self):
+        '''
+        Returns the Learner to its initial state. The proposal and acceptor dictionaries
+        are cleared and retained rather than being reallocated.
+        '''
+        self.proposals.clear()
+        self.acceptors.clear()
+        self.last_proposal_id    = None
+        self.last_proposal       = None
+        self.final_value         = None
+        self.final_acceptor_mask = 0
+        self.final_proposal_id   = None
+
+
+    @property
+    def final_acceptors(self):
+        '''
+        Set of acceptor UIDs that have accepted the final value. None until the final
+        value is chosen.
+        '''
+        if self.final_value is not None:
+            return self.uids_in_mask( self.final_acceptor_mask )
 
         
     def receive_accepted(self, msg):
@@ -310,9 +466,11 @@ class Learner (MessageHandler):
         the consentual value. Subsequent calls after the resolution is chosen will continue to add
         new Acceptors to the final_acceptors set and return Resolution messages.
         '''
+        bit = self.peer_bit( msg.from_uid )
+        
         if self.final_value is not None:
             if msg.proposal_id >= self.final_proposal_id and msg.proposal_value == self.final_value:
-                self.final_acceptors.add( msg.from_uid )
+                self.final_acceptor_mask |= bit
             return Resolution(self.network_uid, self.final_value)
             
         last_pn = self.acceptors.get(msg.from_uid)
@@ -324,28 +482,37 @@ class Learner (MessageHandler):
         
         if last_pn is not None:
             ps = self.proposals[ last_pn ]
-            ps.retain_count -= 1
-            ps.acceptors.remove(msg.from_uid)
-            if ps.retain_count == 0:
+            ps.retain_mask &= ~bit
+            if not ps.retain_mask:
                 del self.proposals[ last_pn ]
 
-        if not msg.proposal_id in self.proposals:
-            self.proposals[ msg.proposal_id ] = Learner.ProposalStatus(msg.proposal_value)
+        if msg.proposal_id == self.last_proposal_id:
+            ps = self.last_proposal # Fast path. Same proposal as the previous message
+        else:
+            ps = self.proposals.get( msg.proposal_id )
+            
+            if ps is None:
+                ps = Learner.ProposalStatus(msg.proposal_value)
+                self.proposals[ msg.proposal_id ] = ps
 
-        ps = self.proposals[ msg.proposal_id ]
+            self.last_proposal_id = msg.proposal_id
+            self.last_proposal    = ps
 
         assert msg.proposal_value == ps.value, 'Value mismatch for single proposal!'
 
+        # The "Old message" check above ensures that the bit cannot already be set
         ps.accept_count += 1
-        ps.retain_count += 1
-        ps.acceptors.add(msg.from_uid)
-
-        if ps.accept_count == self.quorum_size:
-            self.final_proposal_id = msg.proposal_id
-            self.final_value       = msg.proposal_value
-            self.final_acceptors   = ps.acceptors
-            self.proposals         = None
-            self.acceptors         = None
+        ps.accept_mask  |= bit
+        ps.retain_mask  |= bit
+
+        if ps.accept_count == self.accept_quorum_size:
+            self.final_proposal_id   = msg.proposal_id
+            self.final_value         = msg.proposal_value
+            self.final_acceptor_mask = ps.retain_mask
+            self.last_proposal_id    = None
+            self.last_proposal       = None
+            self.proposals.clear()
+            self.acceptors.clear()
 
             return Resolution( self.network_uid, self.final_value )
 
@@ -354,13 +521,33 @@ class Learner (MessageHandler):
 class PaxosInstance (Proposer, Acceptor, Learner):
     '''
     Aggregate Proposer, Accepter, & Learner class.
+
+    If accept_quorum_size is not provided, quorum_size is used for both the
+    Promise and Accepted quorums.
     '''
+    __slots__ = ()
 
-    def __init__(self, network_uid, quorum_size, promised_id=None, accepted_id=None, accepted_value=None):
-        Proposer.__init__(self, network_uid, quorum_size)
+    def __init__(self, network_uid, quorum_size, promised_id=None, accepted_id=None, accepted_value=None,
+                 uid_bits=None, accept_quorum_size=None):
+        if accept_quorum_size is None:
+            accept_quorum_size = quorum_size
+        Proposer.__init__(self, network_uid, quorum_size, uid_bits)
         Acceptor.__init__(self, network_uid, promised_id, accepted_id, accepted_value)
-        Learner.__init__(self, network_uid, quorum_size)
+        Learner.__init__(self, network_uid, accept_quorum_size, self.uid_bits)
+
+
+    def reset(self, promised_id=None, accepted_id=None, accepted_value=None):
+        '''
+        Returns this object to the state of a newly constructed PaxosInstance so
+        that it may be reused for the next link in a multi-paxos chain. This
+        avoids reallocating the object along with its internal sets and
+        dictionaries each time an instance is resolved.
+        '''
+        self._reset_proposer()
+        self._reset_acceptor(promised_id, accepted_id, accepted_value)
+        self._reset_learner()
 
+        
     def receive_prepare(self, msg):
         self.observe_proposal( msg.proposal_id )
         return super(PaxosInstance,self).receive_prepare(msg)
@@ -368,3 +555,318 @@ class PaxosInstance (Proposer, Acceptor, Learner):
     def receive_accept(self, msg):
         self.observe_proposal( msg.proposal_id )
         return super(PaxosInstance,self).receive_accept(msg)
+
+
+
+class PaxosInstancePool (object):
+    '''
+    Maintains a free list of PaxosInstance objects. Applications that keep many
+    Paxos instances alive simultaneously, such as those that pipeline multiple
+    links of the multi-paxos chain or host many independent chains, may use
+    this class to recycle resolved instances rather than allocating new ones.
+    '''
+
+    def __init__(self, network_uid, quorum_size, max_size=64, uid_bits=None, accept_quorum_size=None):
+        self.network_uid        = network_uid
+        self.quorum_size        = quorum_size
+        self.accept_quorum_size = accept_quorum_size if accept_quorum_size is not None else quorum_size
+        self.max_size           = max_size
+        self.uid_bits           = uid_bits if uid_bits is not None else dict()
+        self.free               = list()
+
+        
+    def acquire(self, promised_id=None, accepted_id=None, accepted_value=None):
+        '''
+        Returns a PaxosInstance in its initial state
+        '''
+        if self.free:
+            p = self.free.pop()
+            p.reset(promised_id, accepted_id, accepted_value)
+            return p
+        
+        return PaxosInstance(self.network_uid, self.quorum_size, promised_id, accepted_id, accepted_value,
+                             self.uid_bits, self.accept_quorum_size)
+
+    
+    def release(self, instance):
+        '''
+        Returns a PaxosInstance to the pool. The caller must not retain any
+        references to the instance after releasing it.
+        '''
+        if (len(self.free) < self.max_size and instance.quorum_size == self.quorum_size and
+            instance.accept_quorum_size == self.accept_quorum_size):
+            self.free.append( instance )
+
+
+
+class AcceptorTable (object):
+    '''
+    Holds the Acceptor state of a large number of independent Paxos groups in
+    columns rather than in one Acceptor object per group. Groups are numbered
+    from zero and each holds the state of the current instance of its own
+    multi-paxos chain. For applications that host hundreds of thousands of small
+    replicated values, this reduces the per-group memory to a few dozen bytes
+    and allows operations that span many groups, such as promising a new
+    master's proposal on every group, to run in bulk.
+
+    Proposal numbers are held in array columns and proposal UIDs as their rank
+    within the sorted list of known UIDs so that comparing ranks orders
+    proposal IDs in the same manner as comparing ProposalID tuples. Ranks are
+    held in bytearray columns, which limits the number of distinct proposer
+    UIDs to 254. Rank 0 and a proposal number of -1 represent None. Accepted
+    values are held in a separate arena list that is indexed by a reference
+    column and a flag column marks the groups that hold an accepted value for
+    their current instance.
+
+    The scalar methods mirror those of the Acceptor class and return the same
+    messages. As with the Acceptor class, the state of a group must be
+    persisted prior to transmitting the returned Promise and Accepted messages.
+    '''
+
+    def __init__(self, network_uid, uids=(), size=0):
+        self.network_uid     = network_uid
+        self.uids            = sorted(uids) # uids[rank - 1] is the UID with that rank
+        self.instance        = array.array('l')
+        self.promised_number = array.array('l')
+        self.promised_uid    = bytearray()
+        self.accepted_number = array.array('l')
+        self.accepted_uid    = bytearray()
+        self.value_ref       = array.array('l')
+        self.pending         = bytearray() # 1 for groups with an accepted value in their current instance
+        self.arena           = list()      # accepted values
+        self.free_refs       = list()      # unused arena slots
+
+        if len(self.uids) > 254:
+            raise ValueError('AcceptorTable supports at most 254 proposer UIDs')
+
+        self.add_groups(size)
+
+
+    def __len__(self):
+        return len(self.instance)
+
+
+    def add_groups(self, count):
+        '''
+        Adds count groups, each at instance 0 with no promised or accepted
+        proposal, and returns the number of the first one
+        '''
+        first = len(self.instance)
+        none  = array.array('l', [-1]) * count
+
+        self.instance.extend( array.array('l', [0]) * count )
+        self.promised_number.extend( none )
+        self.promised_uid.extend( bytearray(count) )
+        self.accepted_number.extend( none )
+        self.accepted_uid.extend( bytearray(count) )
+        self.value_ref.extend( none )
+        self.pending.extend( bytearray(count) )
+
+        return first
+
+
+    def uid_rank(self, uid):
+        '''
+        Returns the rank of the UID. Unknown UIDs are added and the ranks held in
+        the table are renumbered to account for them.
+        '''
+        i = bisect.bisect_left(self.uids, uid)
+
+        if i < len(self.uids) and self.uids[i] == uid:
+            return i + 1
+
+        if len(self.uids) == 254:
+            raise ValueError('AcceptorTable supports at most 254 proposer UIDs')
+
+        self.uids.insert(i, uid)
+
+        # Ranks above the new one each move up by one
+        shift = bytes(bytearray( r + 1 if i < r < 255 else r for r in range(256) ))
+
+        self.promised_uid = self.promised_uid.translate(shift)
+        self.accepted_uid = self.accepted_uid.translate(shift)
+
+        return i + 1
+
+
+    def _pid(self, number, rank):
+        if number >= 0:
+            return ProposalID(number, self.uids[rank - 1])
+
+
+    def _set_accepted(self, group, proposal_id, value):
+        ref = self.value_ref[group]
+
+        if ref < 0:
+            if self.free_refs:
+                ref = self.free_refs.pop()
+            else:
+                ref = len(self.arena)
+                self.arena.append(None)
+            self.value_ref[group] = ref
+
+        self.arena[ref]              = value
+        self.accepted_number[group]  = proposal_id.number
+        self.accepted_uid[group]     = self.uid_rank(proposal_id.uid)
+        self.pending[group]          = 1
+
+
+    def _clear_accepted(self, group):
+        ref = self.value_ref[group]
+
+        if ref >= 0:
+            self.arena[ref]         = None
+            self.free_refs.append(ref)
+            self.value_ref[group]   = -1
+
+        self.accepted_number[group] = -1
+        self.accepted_uid[group]    = 0
+        self.pending[group]         = 0
+
+
+    def instance_number(self, group):
+        return self.instance[group]
+
+
+    def promised_id(self, group):
+        return self._pid(self.promised_number[group], self.promised_uid[group])
+
+
+    def accepted_id(self, group):
+        return self._pid(self.accepted_number[group], self.accepted_uid[group])
+
+
+    def accepted_value(self, group):
+        ref = self.value_ref[group]
+        if ref >= 0:
+            return self.arena[ref]
+
+
+    def restore(self, group, instance_number, promised_id=None, accepted_id=None, accepted_value=None):
+        '''
+        Sets the state of a group when recovering from persistent state
+        '''
+        self.instance[group] = instance_number
+
+        if promised_id is None:
+            self.promised_number[group] = -1
+            self.promised_uid[group]    = 0
+        else:
+            self.promised_number[group] = promised_id.number
+            self.promised_uid[group]    = self.uid_rank(promised_id.uid)
+
+        if accepted_id is None:
+            self._clear_accepted(group)
+        else:
+            self._set_accepted(group, accepted_id, accepted_value)
+
+
+    def commit(self, group):
+        '''
+        Advances the group to its next instance once the current one has been
+        resolved. The accepted proposal is discarded and the promise is carried
+        over to the new instance.
+        '''
+        self.instance[group] += 1
+        self._clear_accepted(group)
+
+
+    def _promises(self, group, proposal_id):
+        n = self.promised_number[group]
+        return proposal_id.number > n or (proposal_id.number == n and
+                                          self.uid_rank(proposal_id.uid) >= self.promised_uid[group])
+
+
+    def receive_prepare(self, group, msg):
+        '''
+        Returns either a Promise or a Nack in response
+        '''
+        if self._promises(group, msg.proposal_id):
+            self.promised_number[group] = msg.proposal_id.number
+            self.promised_uid[group]    = self.uid_rank(msg.proposal_id.uid)
+            return Promise(self.network_uid, msg.from_uid, msg.proposal_id, self.accepted_id(group),
+                           self.accepted_value(group))
+        else:
+            return Nack(self.network_uid, msg.from_uid, msg.proposal_id, self.promised_id(group))
+
+
+    def receive_accept(self, group, msg):
+        '''
+        Returns either an Accepted or Nack message in response
+        '''
+        if self._promises(group, msg.proposal_id):
+            self.promised_number[group] = msg.proposal_id.number
+            self.promised_uid[group]    = self.uid_rank(msg.proposal_id.uid)
+            self._set_accepted(group, msg.proposal_id, msg.proposal_value)
+            return Accepted(self.network_uid, msg.proposal_id, msg.proposal_value)
+        else:
+            return Nack(self.network_uid, msg.from_uid, msg.proposal_id, self.promised_id(group))
+
+
+    def promise_range(self, start, stop, proposal_id):
+        '''
+        Promises proposal_id on each group in the range [start, stop) that has
+        not promised a higher proposal and returns the list of groups that
+        have. When proposal_id exceeds every promise in the range, as is the
+        case for a newly elected master, the columns are updated with slice
+        assignments rather than group by group. The accepted proposals that
+        the Promises for the range must report may be found with uncommitted().
+        '''
+        count = stop - start
+        rank  = self.uid_rank(proposal_id.uid)
+
+        if count <= 0:
+            return []
+
+        numbers = self.promised_number[start:stop]
+
+        if proposal_id.number > max(numbers):
+            self.promised_number[start:stop] = array.array('l', [proposal_id.number]) * count
+            self.promised_uid[start:stop]    = bytearray([rank]) * count
+            return []
+
+        if proposal_id.number < min(numbers):
+            return range(start, stop)
+
+        rejected = list()
+
+        for group in xrange(start, stop):
+            n = self.promised_number[group]
+            if proposal_id.number > n or (proposal_id.number == n and rank >= self.promised_uid[group]):
+                self.promised_number[group] = proposal_id.number
+                self.promised_uid[group]    = rank
+            else:
+                rejected.append(group)
+
+        return rejected
+
+
+    def uncommitted(self, start=0, stop=None):
+        '''
+        Returns the list of groups in the range [start, stop) that hold an
+        accepted value for their current instance. A new master must drive
+        these instances to resolution before proposing new values in them.
+        '''
+        if stop is None:
+            stop = len(self.pending)
+
+        groups = list()
+        group  = self.pending.find(b'\x01', start, stop)
+
+        while group != -1:
+            groups.append(group)
+            group = self.pending.find(b'\x01', group + 1, stop)
+
+        return groups
+
+
+    def memory_usage(self):
+        '''
+        Returns the number of bytes used by the columns, excluding the accepted
+        values themselves
+        '''
+        columns = (self.instance, self.promised_number, self.accepted_number, self.value_ref)
+
+        return (sum( len(c) * c.itemsize for c in columns ) + len(self.promised_uid) +
+                len(self.accepted_uid) + len(self.pending) + sys.getsizeof(self.arena) +
+                sys.getsizeof(self.free_refs))
@@ -1,11 +1,71 @@
+import json
 
 # (IP,UDP Port Number)
 peers = dict( A=('127.0.0.1',1234),
               B=('127.0.0.1',1235),
               C=('127.0.0.1',1236) )
 
+# Non-voting learner replicas. Same format as peers. Learners receive copies
+# of the replicated value and serve reads but do not participate in the Paxos
+# algorithm
+learners = dict()
+
 # State files for crash recovery. Windows users will need to modify
 # these.
 state_files = dict( A='/tmp/A.json',
                     B='/tmp/B.json',
                     C='/tmp/C.json' )
+
+# Number of peers required to complete phase 1 (Promise) and phase 2 (Accepted)
+# of each Paxos instance. None selects the default. See
+# replicated_value.quorum_sizes() for details
+quorum_size        = None
+accept_quorum_size = None
+
+# Hosts, other than those of the peers and learners, from which servers accept
+# administrative requests such as 'profile' messages
+admin_hosts = ['127.0.0.1']
+
+
+def load(filename):
+    '''
+    Replaces the configuration defined above with the content of a JSON file. The
+    'peers' entry is required and maps each peer UID to an [IP, Port] list. The
+    'learners', 'state_files', 'quorum_size', 'accept_quorum_size', and
+    'admin_hosts' entries are optional. State files default to /tmp/<UID>.json
+    and admin hosts to 127.0.0.1 only. For example:
+
+        { "peers"              : { "A" : ["127.0.0.1", 1234], ... },
+          "learners"           : { "L1" : ["127.0.0.1", 1300], ... },
+          "quorum_size"        : 5,
+          "accept_quorum_size" : 3,
+          "admin_hosts"        : ["127.0.0.1", "10.0.0.5"] }
+    '''
+    global peers, learners, state_files, quorum_size, accept_quorum_size, admin_hosts
+
+    with open(filename) as f:
+        m = json.loads(f.read())
+
+    # JSON encodes the addresses as lists of unicode strings and integers. They
+    # must be converted to the (str, int) tuples used by the Messenger's
+    # address to UID mapping
+    def addrs(d):
+        return dict( (str(uid), (str(addr[0]), int(addr[1]))) for uid, addr in d.items() )
+
+    peers              = addrs( m['peers'] )
+    learners           = addrs( m.get('learners', dict()) )
+    state_files        = dict( (uid, '/tmp/{0}.json'.format(uid)) for uid in all_nodes() )
+    quorum_size        = m.get('quorum_size')
+    accept_quorum_size = m.get('accept_quorum_size')
+    admin_hosts        = [ str(host) for host in m.get('admin_hosts', ['127.0.0.1']) ]
+
+    state_files.update( (str(uid), fn) for uid, fn in m.get('state_files', dict()).items() )
+
+
+def all_nodes():
+    '''
+    Returns a dictionary containing the addresses of all peers and learners
+    '''
+    d = dict(peers)
+    d.update(learners)
+    return d
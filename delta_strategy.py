@@ -0,0 +1,113 @@
+# This module provides a Mixin class that allows the replicated value to be
+# updated via patches rather than by replacing the entire value. When the value
+# is large and updates are small, this greatly reduces the size of the values
+# that must be carried through the Paxos messages.
+#
+# Patches are added to the chain as specially marked values. Each patch is a
+# list of [offset, length, data] splice operations that replace the 'length'
+# characters starting at 'offset' with 'data'. The operations are applied in
+# order and each offset refers to the value produced by the preceding
+# operations. Every peer applies resolved patches to its local copy of the value
+# in advance_instance so the current value itself never needs to be sent.
+#
+# Each patch also carries a checksum of the value it was created against. If
+# the checksum does not match the local value, the patch is rejected and the
+# value is left unchanged. As all peers hold the same value for each instance,
+# this occurs on every peer when the proposer's copy of the value was out of
+# date. A mismatch on only some of the peers indicates that their values have
+# diverged.
+#
+# Catchup messages always carry the full value.
+#
+# This mixin must follow DedicatedMasterStrategyMixin in the inheritance order
+# so that it sees the decoded application-level values in advance_instance.
+#
+import json
+import zlib
+
+
+# Values in the chain that begin with this prefix are patches
+PATCH_PREFIX = '\x00patch '
+
+
+def checksum(value):
+    if value is None:
+        value = ''
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return zlib.crc32(value) & 0xffffffff
+
+
+def apply_patch(value, ops):
+    '''
+    Returns the result of applying the list of [offset, length, data] splice
+    operations to the value. Raises ValueError if an operation is malformed or
+    out of range.
+    '''
+    if value is None:
+        value = u''
+    elif isinstance(value, str):
+        value = value.decode('utf-8') # Offsets refer to characters, not bytes
+
+    if not isinstance(ops, list):
+        raise ValueError('Patch operations must be a list')
+
+    for op in ops:
+        if not (isinstance(op, list) and len(op) == 3):
+            raise ValueError('Patch operations must be [offset, length, data] lists')
+
+        offset, length, data = op
+
+        if not (isinstance(offset, (int, long)) and isinstance(length, (int, long)) and isinstance(data, basestring)):
+            raise ValueError('Patch offsets and lengths must be integers and data must be a string')
+
+        if offset < 0 or length < 0 or offset + length > len(value):
+            raise ValueError('Patch operation [{0}, {1}] is out of range for a value of length {2}'.format(offset, length,
+                                                                                                          len(value)))
+        value = value[:offset] + data + value[offset + length:]
+
+    return value
+
+
+class DeltaStrategyMixin (object):
+
+    def propose_patch(self, ops):
+        '''
+        Proposes a patch to the current value. The ops argument is a list of
+        [offset, length, data] splice operations.
+        '''
+        # Raises ValueError for invalid operations. These must be caught prior to
+        # adding the patch to the chain.
+        apply_patch(self.current_value, ops)
+
+        self.propose_update( PATCH_PREFIX + json.dumps( dict(base = checksum(self.current_value),
+                                                             ops  = ops) ) )
+
+    #--------------------------------------------------------------------------------
+    # Method Overrides
+    #
+    def advance_instance(self, new_instance_number, new_current_value, catchup=False):
+        if not catchup and isinstance(new_current_value, basestring) and new_current_value.startswith(PATCH_PREFIX):
+            # Malformed patches are rejected by every peer so the instance
+            # becomes a no-op and the chain continues
+            try:
+                patch = json.loads( new_current_value[len(PATCH_PREFIX):] )
+                if not isinstance(patch, dict) or 'base' not in patch or 'ops' not in patch:
+                    raise ValueError('Patches must contain base and ops entries')
+            except ValueError, e:
+                print 'PATCH REJECTED.', e
+                patch = None
+
+            new_current_value = self.current_value
+
+            if patch is None:
+                pass
+            elif patch['base'] != checksum(self.current_value):
+                print 'PATCH REJECTED. Checksum mismatch. The proposer was out of date or this peer has diverged'
+            else:
+                try:
+                    new_current_value = apply_patch(self.current_value, patch['ops'])
+                except ValueError, e:
+                    print 'PATCH REJECTED.', e
+
+        super(DeltaStrategyMixin,self).advance_instance(new_instance_number, new_current_value, catchup=catchup)
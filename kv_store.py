@@ -0,0 +1,285 @@
+# This module provides a key-value state machine for use with the
+# StateMachineMixin class. Keys are strings and values may be any JSON-encodable
+# value.
+#
+# Two indexes are maintained. A dictionary serves point lookups and a sorted
+# list of keys serves range scans via binary search. Commands are batches of
+# operations that are applied atomically:
+#
+#    {"ops": [["put",    key, value],
+#             ["delete", key],
+#             ["cas",    key, expected_value, new_value]]}
+#
+# An expected_value of None requires that the key not exist and a new_value of
+# None deletes the key. The compare-and-set conditions of a batch are evaluated
+# against the state prior to the batch and if any fail, none of the operations
+# in the batch are applied. Malformed batches are likewise rejected in their
+# entirety.
+#
+# Queries take one of the following forms:
+#
+#    {"get":  [key, ...]}                        => {key: value|None, ...}
+#    {"scan": [start_key, end_key, limit]}       => [[key, value], ...]
+#
+# Scans return keys k where start_key <= k < end_key. A start_key or end_key of
+# None leaves that end of the range unbounded and a limit of None returns all
+# matching keys.
+#
+# The store may also be saved to a binary snapshot file that is memory-mapped
+# when opened. Nothing is read from a mapped snapshot until a lookup requires
+# it, so opening a snapshot takes the same time regardless of its size. When a
+# snapshot is open, the in-memory indexes hold only the changes made since it
+# was written and deleted keys are recorded with a marker. Lookups consult the
+# in-memory indexes first and fall back to a binary search of the snapshot.
+#
+# Snapshot layout. All integers are big-endian:
+#
+#    header:  'KVS1', instance_number (u64), entry count (u64), index offset (u64)
+#    data:    for each entry, the UTF-8 encoded key followed by the JSON-encoded
+#             value
+#    index:   for each entry in key order, data offset (u64), key length (u32),
+#             value length (u32)
+#
+import os
+import json
+import mmap
+import struct
+import bisect
+import itertools
+
+
+SNAPSHOT_MAGIC  = 'KVS1'
+SNAPSHOT_HEADER = struct.Struct('>4sQQQ')
+SNAPSHOT_ENTRY  = struct.Struct('>QII')
+
+# Number of list elements in each type of operation, including the name
+op_arity = dict( put = 3, delete = 2, cas = 4 )
+
+
+class Deleted (object):
+    '''
+    Marks keys in the in-memory indexes that have been deleted from the snapshot
+    '''
+    def __repr__(self):
+        return '<deleted>'
+
+DELETED = Deleted()
+
+
+
+class MappedSnapshot (object):
+    '''
+    Read-only view of a snapshot file. Keys and values are decoded on demand.
+    '''
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.instance_number, self.count, self.index_offset = SNAPSHOT_HEADER.unpack_from(self.map, 0)
+
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('Invalid snapshot file: ' + filename)
+
+
+    def close(self):
+        self.map.close()
+
+
+    def entry(self, i):
+        return SNAPSHOT_ENTRY.unpack_from(self.map, self.index_offset + i * SNAPSHOT_ENTRY.size)
+
+
+    def key_at(self, i):
+        offset, key_len, value_len = self.entry(i)
+        return self.map[offset : offset + key_len].decode('utf-8')
+
+
+    def value_at(self, i):
+        offset, key_len, value_len = self.entry(i)
+        return json.loads( self.map[offset + key_len : offset + key_len + value_len] )
+
+
+    def find(self, key):
+        '''
+        Returns the index of the first entry with a key >= the provided key
+        '''
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+    def get(self, key):
+        i = self.find(key)
+        if i < self.count and self.key_at(i) == key:
+            return self.value_at(i)
+
+
+    def items(self, start=None, end=None):
+        i = 0 if start is None else self.find(start)
+        while i < self.count:
+            key = self.key_at(i)
+            if end is not None and key >= end:
+                return
+            yield key, self.value_at(i)
+            i += 1
+
+
+    @staticmethod
+    def write(filename, instance_number, items):
+        '''
+        Writes a snapshot of the (key, value) pairs, which must be provided in
+        key order. Only the index is held in memory while writing.
+        '''
+        index  = list()
+        offset = SNAPSHOT_HEADER.size
+
+        with open(filename, 'wb') as f:
+            f.write( SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, 0, 0, 0) )
+
+            for key, value in items:
+                k = key.encode('utf-8')
+                v = json.dumps(value)
+                f.write( k )
+                f.write( v )
+                index.append( SNAPSHOT_ENTRY.pack(offset, len(k), len(v)) )
+                offset += len(k) + len(v)
+
+            f.write( ''.join(index) )
+            f.seek(0)
+            f.write( SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, instance_number, len(index), offset) )
+            f.flush()
+            os.fsync(f.fileno())
+
+
+
+class KeyValueStore (object):
+
+    def __init__(self):
+        self.base = None   # MappedSnapshot, if one is open
+        self.data = dict() # All entries or, if a snapshot is open, the changes made since it was written
+        self.keys = list() # Sorted index of the keys in self.data
+
+
+    def restore(self, snapshot):
+        self.close_snapshot()
+        self.data = json.loads(snapshot) if snapshot else dict()
+        self.keys = sorted(self.data.keys())
+
+
+    def snapshot(self):
+        return json.dumps(dict(self.items()), sort_keys=True)
+
+
+    def save_snapshot(self, filename, instance_number):
+        MappedSnapshot.write(filename, instance_number, self.items())
+
+
+    def open_snapshot(self, filename):
+        '''
+        Replaces the current state with that of the snapshot file and returns the
+        instance number at which the snapshot was taken
+        '''
+        base = MappedSnapshot(filename)
+        self.close_snapshot()
+        self.base = base
+        self.data = dict()
+        self.keys = list()
+        return base.instance_number
+
+
+    def close_snapshot(self):
+        if self.base is not None:
+            self.base.close()
+            self.base = None
+
+
+    def get(self, key):
+        if key in self.data:
+            v = self.data[key]
+            return None if v is DELETED else v
+        elif self.base is not None:
+            return self.base.get(key)
+
+
+    def items(self, start=None, end=None):
+        '''
+        Generates the (key, value) pairs for which start <= key < end in key order
+        '''
+        lo = 0              if start is None else bisect.bisect_left(self.keys, start)
+        hi = len(self.keys) if end   is None else bisect.bisect_left(self.keys, end)
+
+        changes = iter(self.keys[lo:hi])
+        base    = self.base.items(start, end) if self.base is not None else iter(())
+
+        c = next(changes, None)
+        b = next(base, None)
+
+        while c is not None or b is not None:
+            if b is None or (c is not None and c <= b[0]):
+                if b is not None and b[0] == c:
+                    b = next(base, None) # Superseded by the change
+
+                v = self.data[c]
+                if v is not DELETED:
+                    yield c, v
+
+                c = next(changes, None)
+            else:
+                yield b
+                b = next(base, None)
+
+
+    def put(self, key, value):
+        if key not in self.data:
+            bisect.insort(self.keys, key)
+        self.data[key] = value
+
+
+    def delete(self, key):
+        if self.base is not None:
+            self.put(key, DELETED)
+        elif key in self.data:
+            del self.data[key]
+            del self.keys[ bisect.bisect_left(self.keys, key) ]
+
+
+    def apply(self, command):
+        ops = command.get('ops') if isinstance(command, dict) else None
+
+        if not isinstance(ops, list):
+            return 'REJECTED. Commands must contain a list of operations'
+
+        for op in ops:
+            if not isinstance(op, list) or not op or not isinstance(op[0], basestring) or op_arity.get(op[0]) != len(op):
+                return 'REJECTED. Invalid operation: {0}'.format(op)
+
+            if not isinstance(op[1], basestring):
+                return 'REJECTED. Keys must be strings: {0}'.format(op)
+
+            if op[0] == 'cas' and self.get(op[1]) != op[2]:
+                return 'REJECTED. Compare-and-set failed for key: {0}'.format(op[1])
+
+        for op in ops:
+            if op[0] == 'put':
+                self.put(op[1], op[2])
+            elif op[0] == 'delete' or op[3] is None:
+                self.delete(op[1])
+            else:
+                self.put(op[1], op[3])
+
+        return 'Applied {0} operations'.format(len(ops))
+
+
+    def query(self, request):
+        if 'get' in request:
+            return dict( (key, self.get(key)) for key in request['get'] )
+
+        start, end, limit = request['scan']
+
+        return [ [key, value] for key, value in itertools.islice(self.items(start, end), limit) ]
@@ -0,0 +1,114 @@
+# This module provides Mixin classes that allow non-voting learner replicas to
+# be attached to the multi-paxos chain. Learner replicas hold a copy of the
+# current value and serve reads locally but they never participate in the
+# Paxos algorithm itself. As they are not included in the peers list, they do
+# not count towards the quorum sizes and any number of them may be added
+# without slowing down the resolution of new links in the chain.
+#
+# Learner replicas receive updates in two ways. The peer that drives an
+# instance to resolution pushes the new value to all learners via a 'catchup'
+# message as soon as resolution is achieved. Learners also periodically poll a
+# random peer with a 'sync_request' message. The peer responds with a
+# 'catchup' message if the learner has fallen behind or a 'sync_ack' message
+# if it is up to date. The time at which the learner last confirmed that it was
+# up to date provides the staleness bound that is reported with each read.
+#
+import time
+import random
+
+
+class LearnerPublisherMixin (object):
+    '''
+    Used by voting peers to keep learner replicas up to date. The UIDs of the
+    learner replicas must be provided in the 'learners' attribute.
+    '''
+
+    learners = ()
+
+    def advance_instance(self, new_instance_number, new_current_value, catchup=False):
+        # Capture the leadership flag before the base class resets the PaxosInstance
+        drove_resolution = self.paxos.leader
+
+        super(LearnerPublisherMixin,self).advance_instance(new_instance_number, new_current_value, catchup=catchup)
+
+        if drove_resolution and not catchup:
+            for uid in self.learners:
+                self.messenger.send_catchup(uid, self.instance_number, self.current_value)
+
+
+    def receive_sync_request(self, from_uid, instance_number):
+        super(LearnerPublisherMixin,self).receive_sync_request(from_uid, instance_number)
+
+        if from_uid in self.learners and instance_number == self.instance_number:
+            self.messenger.send_sync_ack(from_uid, self.instance_number)
+
+
+
+class LearnerReplicaMixin (object):
+    '''
+    Used by learner replicas. Learners never vote, never propose values, and
+    ignore all Paxos messages. They must be combined with a synchronization
+    strategy that periodically sends sync_request messages to the voting peers.
+    '''
+
+    sync_delay      = 1.0  # Overrides SimpleSynchronizationStrategyMixin.sync_delay
+    synchronized_at = None # Time at which this replica last knew it was up to date
+
+
+    def staleness(self):
+        '''
+        The staleness bound is the number of seconds since this replica last
+        confirmed that it held the current value. It is measured relative to
+        the knowledge of the peer that confirmed it and ignores network delays.
+        '''
+        if self.synchronized_at is not None:
+            return time.time() - self.synchronized_at
+
+        return super(LearnerReplicaMixin,self).staleness()
+
+
+    def receive_catchup(self, from_uid, instance_number, current_value):
+        super(LearnerReplicaMixin,self).receive_catchup(from_uid, instance_number, current_value)
+
+        if instance_number >= self.instance_number:
+            self.synchronized_at = time.time()
+
+
+    def receive_sync_ack(self, from_uid, instance_number):
+        if instance_number == self.instance_number:
+            self.synchronized_at = time.time()
+
+    #--------------------------------------------------------------------------------
+    # Method Overrides
+    #
+    def propose_update(self, new_value):
+        print 'IGNORING CLIENT REQUEST. Learner replicas cannot propose values'
+
+    def propose_patch(self, ops):
+        # Learners may be run with an update strategy that does not support
+        # patches. Either way the patch cannot be proposed here so the learner
+        # asks a voting peer for the current value instead.
+        print 'IGNORING CLIENT PATCH. Learner replicas cannot propose values'
+        if self.peers:
+            self.messenger.send_sync_request(random.choice(self.peers), self.instance_number)
+
+    def propose_command(self, command):
+        print 'IGNORING CLIENT COMMAND. Learner replicas cannot propose values'
+
+    def receive_sync_request(self, from_uid, instance_number):
+        pass # Only voting peers are authoritative sources for synchronization
+
+    def receive_prepare(self, from_uid, instance_number, proposal_id):
+        pass
+
+    def receive_nack(self, from_uid, instance_number, proposal_id, promised_proposal_id):
+        pass
+
+    def receive_promise(self, from_uid, instance_number, proposal_id, last_accepted_id, last_accepted_value):
+        pass
+
+    def receive_accept(self, from_uid, instance_number, proposal_id, proposal_value):
+        pass
+
+    def receive_accepted(self, from_uid, instance_number, proposal_id, proposal_value):
+        pass
@@ -1,14 +1,25 @@
 # This module provides an optional Mixin class that implements master leases
 # and single-round-trip resolution on Paxos instances while the lease is held.
 #
+# While a master lease is held, phase 1 of the Paxos algorithm is run once for
+# all subsequent instances rather than once per instance. Promises made by the
+# acceptors are carried over, and saved to disk, as the chain advances so a
+# Promise made in one instance applies to that instance and every later one.
+# Acceptors participate only in the current instance so the accepted value of
+# that instance, which the Promise reports, is the only one that may be
+# outstanding. Once the master has received a quorum of Promises, it assumes
+# leadership of each new instance as it is reached and sends Accept messages
+# directly. Phase 1 is repeated only if the master's proposals are rejected or
+# the membership of the chain changes.
+#
 import json
 import random
 import os.path
 import time
 
-from twisted.internet import reactor, defer, task
+import runtime
 
-from composable_paxos import ProposalID, Prepare, Promise
+from replicated_value import UNCHANGED
 
 
         
@@ -21,6 +32,9 @@ class DedicatedMasterStrategyMixin (object):
 
     master_attempt = False # Limits peer attempts to become the master
 
+    leader_proposal_id = None # Proposal ID promised by a quorum for the current and all later instances
+    leader_quorum      = None # Membership for which the leader_proposal_id Promises were received
+
     _initial_load  = True
 
 
@@ -30,7 +44,7 @@ class DedicatedMasterStrategyMixin (object):
         if self.lease_expiry is not None and self.lease_expiry.active():
             self.lease_expiry.cancel()
             
-        self.lease_expiry = reactor.callLater(self.lease_window, self.lease_expired)
+        self.lease_expiry = runtime.call_later(self.lease_window, self.lease_expired)
 
         
     def update_lease(self, master_uid):
@@ -38,12 +52,13 @@ class DedicatedMasterStrategyMixin (object):
 
         if self.network_uid != master_uid:
             self.start_master_lease_timer()
+            self.leader_proposal_id = None
 
         if master_uid == self.network_uid:
             renew_delay = (self.lease_start + self.lease_window - 1) - time.time()
             
             if renew_delay > 0:
-                reactor.callLater(renew_delay, lambda : self.propose_update(self.network_uid, False))
+                runtime.call_later(renew_delay, lambda : self.propose_update(self.network_uid, False))
             else:
                 self.propose_update(self.network_uid, False)
 
@@ -51,7 +66,25 @@ class DedicatedMasterStrategyMixin (object):
     def lease_expired(self):
         self.master_uid = None
         self.propose_update( self.network_uid, False )
-    
+
+
+    def current_quorum(self):
+        return tuple(sorted(self.peers)), self.quorum_size, self.accept_quorum_size
+
+
+    def resume_leadership(self):
+        '''
+        Called when a new instance is reached. If this peer is the master and
+        still holds the Promises of a quorum, phase 1 is skipped.
+        '''
+        if self.promised_id is not None:
+            # Ensure any Prepare messages sent by this peer exceed the carried-over promise
+            self.paxos.observe_proposal( self.promised_id )
+
+        if (self.master_uid == self.network_uid and self.leader_proposal_id is not None and
+            self.leader_proposal_id == self.promised_id and self.leader_quorum == self.current_quorum()):
+            self.paxos.resume_leadership( self.leader_proposal_id )
+
 
     #--------------------------------------------------------------------------------
     # Method Overrides
@@ -88,51 +121,60 @@ class DedicatedMasterStrategyMixin (object):
         if self.master_uid == self.network_uid:
             self.stop_driving()
 
-            if self.paxos.proposal_id.number == 1:
+            if self.paxos.leader and self.paxos.proposal_id == self.leader_proposal_id:
                 self.send_accept(self.paxos.proposal_id, self.paxos.proposed_value)
             else:
-                self.paxos.prepare()
+                m = self.paxos.prepare()
 
-            self.retransmit_task = task.LoopingCall( lambda : self.send_prepare(self.paxos.proposal_id) )
-            self.retransmit_task.start( self.retransmit_interval/1000.0, now=False )
+                self.retransmit_task = runtime.looping_call( self.retransmit_interval/1000.0,
+                                                             lambda : self.send_prepare(m.proposal_id) )
         else:
             super(DedicatedMasterStrategyMixin,self).drive_to_resolution()
         
 
+    def save_state(self, instance_number, current_value, promised_id, accepted_id, accepted_value):
+        if promised_id is None:
+            promised_id = self.promised_id # Promises apply to all subsequent instances
+
+        super(DedicatedMasterStrategyMixin,self).save_state(instance_number, current_value, promised_id,
+                                                            accepted_id, accepted_value)
+
+
     def advance_instance(self, new_instance_number, new_current_value, catchup=False):
 
         self.master_attempt = False
 
-        if catchup:
-            super(DedicatedMasterStrategyMixin,self).advance_instance(new_instance_number, new_current_value)
-            self.paxos.prepare() # ensure we won't send any prepare messages with ID 1 (might conflict with the current master)
-            return
-        
-        t = json.loads(new_current_value) # Returns a list: [master_uid, application_value]. Only one element will be valid
+        if not catchup:
+            t = json.loads(new_current_value) # Returns a list: [master_uid, application_value]. Only one element will be valid
 
-        if t[0] is not None:
-            print '   Lease Granted: ', t[0]
-            self.update_lease( t[0] )
-            
-            new_current_value = self.current_value
-        else:
-            print '   Application Value:', t[1]
-            new_current_value = t[1]
+            if t[0] is not None:
+                print '   Lease Granted: ', t[0]
+                self.update_lease( t[0] )
 
-        super(DedicatedMasterStrategyMixin,self).advance_instance(new_instance_number, new_current_value)
+                new_current_value = UNCHANGED
+            else:
+                print '   Application Value:', t[1]
+                new_current_value = t[1]
 
-        if self.master_uid:
+        super(DedicatedMasterStrategyMixin,self).advance_instance(new_instance_number, new_current_value, catchup=catchup)
 
-            master_pid = ProposalID(1,self.master_uid)
-            
-            if self.master_uid == self.network_uid:
-                self.paxos.prepare()
-                
-                for uid in self.peers:
-                    self.paxos.receive_promise( Promise(uid, self.network_uid, master_pid, None, None) )
-            else:
-                self.paxos.receive_prepare( Prepare(self.master_uid, master_pid) )
-                self.paxos.observe_proposal( master_pid )
+        self.resume_leadership()
+
+
+    def receive_promise(self, from_uid, instance_number, proposal_id, last_accepted_id, last_accepted_value):
+        super(DedicatedMasterStrategyMixin,self).receive_promise(from_uid, instance_number, proposal_id,
+                                                                 last_accepted_id, last_accepted_value)
+
+        if self.paxos.leader and self.paxos.proposal_id != self.leader_proposal_id:
+            self.leader_proposal_id = self.paxos.proposal_id
+            self.leader_quorum      = self.current_quorum()
+
+
+    def receive_nack(self, from_uid, instance_number, proposal_id, promised_proposal_id):
+        if proposal_id == self.leader_proposal_id:
+            self.leader_proposal_id = None # Another peer has prepared a higher proposal
+
+        super(DedicatedMasterStrategyMixin,self).receive_nack(from_uid, instance_number, proposal_id, promised_proposal_id)
 
 
     def receive_prepare(self, from_uid, instance_number, proposal_id):
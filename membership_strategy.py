@@ -0,0 +1,284 @@
+# This module provides a Mixin class that allows the set of peers
+# participating in the multi-paxos chain to be changed while the chain is in
+# use.
+#
+# Membership changes are added to the chain as specially marked values. When
+# a membership change is resolved in instance N, it does not take effect
+# immediately. Instead, the new membership is used for instances N + alpha and
+# beyond. As every peer learns about the change before it reaches the
+# effective instance, all peers agree on the membership of each instance
+# without any additional coordination.
+#
+# Peers that are added by a membership change are sent the new membership
+# configuration and the current value as soon as the change is resolved and,
+# until the change takes effect, they also receive copies of all Accepted
+# messages. This allows the new peers to keep up with the chain before they
+# are allowed to vote. Peers that are not members of the current instance never
+# propose values or respond to Prepare or Accept messages and messages from
+# non-members are ignored.
+#
+# This mixin must precede the resolution strategy in the inheritance order so
+# that proposals made by non-members are dropped before the resolution
+# strategy attempts to drive them forward. When used with the master strategy,
+# it must follow DedicatedMasterStrategyMixin so that it sees the decoded
+# application-level values in advance_instance.
+#
+# The current membership and any pending changes are saved to a file alongside
+# the state file so that they survive restarts.
+#
+import os
+import json
+
+from replicated_value import quorum_sizes, UNCHANGED
+
+
+# Values in the chain that begin with this prefix are membership changes
+MEMBERSHIP_PREFIX = '\x00membership '
+
+
+def normalize_members(members):
+    '''
+    Returns a copy of the members dictionary containing only the recognized
+    entries. Raises ValueError if the dictionary does not describe a valid
+    membership.
+    '''
+    if not isinstance(members, dict) or not isinstance(members.get('peers'), dict) or not members['peers']:
+        raise ValueError('The membership must include a non-empty dictionary of peers')
+
+    for addr in members['peers'].values():
+        if addr is not None and not (isinstance(addr, (list, tuple)) and len(addr) == 2 and isinstance(addr[1], int)):
+            raise ValueError('Peer addresses must be [IP, Port] lists')
+
+    members = dict(peers              = members['peers'],
+                   quorum_size        = members.get('quorum_size'),
+                   accept_quorum_size = members.get('accept_quorum_size'))
+
+    quorum_sizes(len(members['peers']), members['quorum_size'], members['accept_quorum_size'])
+
+    return members
+
+
+class ReconfigurationStrategyMixin (object):
+
+    membership_alpha = 3 # Number of instances between resolution and use of a membership change
+
+    members          = None # dict(peers={uid:[ip,port]}, quorum_size=int|None, accept_quorum_size=int|None)
+    pending_members  = None # list of [effective_instance_number, members] lists
+    stashed_members  = None # [instance_number, members, pending] received ahead of a catchup message
+
+
+    def propose_reconfiguration(self, members):
+        '''
+        Proposes a new membership for the chain. The members argument is a dictionary
+        with a 'peers' entry that maps each peer UID to an [IP, Port] list and
+        optional 'quorum_size' and 'accept_quorum_size' entries.
+        '''
+        # Raises ValueError for invalid memberships. These must be caught prior to
+        # adding the change to the chain.
+        members = normalize_members(members)
+
+        self.propose_update( MEMBERSHIP_PREFIX + json.dumps(members) )
+
+
+    def is_member(self, uid):
+        return uid in self.peers
+
+
+    def members_file(self):
+        return self.state_file + '.members'
+
+
+    def save_members(self):
+        tmp = self.members_file() + '.tmp'
+
+        with open(tmp, 'w') as f:
+            f.write( json.dumps( dict(members = self.members,
+                                      pending = self.pending_members) ) )
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(tmp, self.members_file())
+
+
+    def use_members(self, members):
+        '''
+        Switches to the provided membership for the current and all subsequent instances
+        '''
+        self.members = members
+        self.peers   = sorted(members['peers'].keys())
+
+        self.quorum_size, self.accept_quorum_size = quorum_sizes(len(self.peers), members['quorum_size'],
+                                                                 members['accept_quorum_size'])
+
+        self.paxos.quorum_size        = self.quorum_size
+        self.paxos.accept_quorum_size = self.accept_quorum_size
+
+        self.add_addresses(members)
+
+        print 'MEMBERSHIP: ', self.instance_number, ', '.join(self.peers)
+
+
+    def add_addresses(self, members):
+        if self.messenger is not None:
+            for uid, addr in members['peers'].items():
+                if addr is not None and uid != self.network_uid:
+                    self.messenger.add_address(uid, addr)
+
+
+    def apply_pending_members(self):
+        '''
+        Switches to any pending membership changes that have reached their effective
+        instance. Returns True if the membership changed.
+        '''
+        changed = False
+
+        while self.pending_members and self.pending_members[0][0] <= self.instance_number:
+            self.use_members( self.pending_members.pop(0)[1] )
+            changed = True
+
+        return changed
+
+
+    def joining_peers(self):
+        '''
+        Returns the set of peers added by pending membership changes that are
+        not members of the current instance
+        '''
+        s = set()
+        for effective_instance, members in self.pending_members:
+            s.update( members['peers'].keys() )
+        s.difference_update( self.peers )
+        s.discard( self.network_uid )
+        return s
+
+
+    def send_membership(self, uid):
+        self.messenger.send_membership(uid, self.instance_number, self.members, self.pending_members)
+
+    #--------------------------------------------------------------------------------
+    # Method Overrides
+    #
+    def propose_update(self, new_value):
+        if self.is_member(self.network_uid):
+            super(ReconfigurationStrategyMixin,self).propose_update(new_value)
+        else:
+            print 'IGNORING PROPOSAL. This peer is not a member of the current instance'
+
+            
+    def load_state(self):
+        super(ReconfigurationStrategyMixin,self).load_state()
+
+        if self.members is not None:
+            return # Only load on the initial call from the constructor
+
+        if os.path.exists(self.members_file()):
+            with open(self.members_file()) as f:
+                m = json.loads(f.read())
+
+            self.members         = m['members']
+            self.pending_members = m['pending']
+            self.peers           = sorted(self.members['peers'].keys())
+
+            self.quorum_size, self.accept_quorum_size = quorum_sizes(len(self.peers),
+                                                                     self.members['quorum_size'],
+                                                                     self.members['accept_quorum_size'])
+        else:
+            self.members         = dict(peers              = dict( (uid, None) for uid in self.peers ),
+                                        quorum_size        = self.quorum_size,
+                                        accept_quorum_size = self.accept_quorum_size)
+            self.pending_members = list()
+
+
+    def set_messenger(self, messenger):
+        super(ReconfigurationStrategyMixin,self).set_messenger(messenger)
+
+        self.add_addresses( self.members )
+        for effective_instance, members in self.pending_members:
+            self.add_addresses( members )
+
+        # A crash may have occurred between advancing the instance and applying the change
+        if self.apply_pending_members():
+            self.save_members()
+
+
+    def advance_instance(self, new_instance_number, new_current_value, catchup=False):
+        new_members = None
+
+        if not catchup and isinstance(new_current_value, basestring) and new_current_value.startswith(MEMBERSHIP_PREFIX):
+            try:
+                new_members = normalize_members( json.loads(new_current_value[len(MEMBERSHIP_PREFIX):]) )
+            except ValueError as e:
+                # Every peer rejects the same resolved value so the instance
+                # becomes a no-op and the chain continues
+                print 'IGNORING INVALID MEMBERSHIP CHANGE: ', e
+
+            new_current_value = UNCHANGED # Membership changes do not modify the application value
+
+            if new_members is not None:
+                self.pending_members.append( [new_instance_number - 1 + self.membership_alpha, new_members] )
+                self.add_addresses( new_members )
+
+        super(ReconfigurationStrategyMixin,self).advance_instance(new_instance_number, new_current_value, catchup=catchup)
+
+        changed = new_members is not None
+
+        if self.stashed_members is not None and self.stashed_members[0] == self.instance_number:
+            instance_number, self.members, self.pending_members = self.stashed_members
+            self.stashed_members = None
+            self.use_members( self.members )
+            changed = True
+
+        if self.apply_pending_members() or changed:
+            self.save_members()
+
+        if new_members is not None:
+            for uid in self.joining_peers():
+                self.send_membership(uid)
+                self.messenger.send_catchup(uid, self.instance_number, self.current_value)
+
+
+    def send_accepted(self, proposal_id, proposal_value):
+        super(ReconfigurationStrategyMixin,self).send_accepted(proposal_id, proposal_value)
+
+        for uid in self.joining_peers():
+            self.messenger.send_accepted(uid, self.instance_number, proposal_id, proposal_value)
+
+
+    def receive_sync_request(self, from_uid, instance_number):
+        if instance_number < self.instance_number:
+            self.send_membership(from_uid)
+
+        super(ReconfigurationStrategyMixin,self).receive_sync_request(from_uid, instance_number)
+
+
+    def receive_membership(self, from_uid, instance_number, members, pending):
+        if instance_number == self.instance_number:
+            self.members, self.pending_members = members, pending
+            self.use_members( members )
+            self.apply_pending_members()
+            self.save_members()
+        elif instance_number > self.instance_number:
+            # Wait for the corresponding catchup message
+            self.stashed_members = [instance_number, members, pending]
+
+
+    def receive_prepare(self, from_uid, instance_number, proposal_id):
+        if self.is_member(self.network_uid):
+            super(ReconfigurationStrategyMixin,self).receive_prepare(from_uid, instance_number, proposal_id)
+
+    def receive_accept(self, from_uid, instance_number, proposal_id, proposal_value):
+        if self.is_member(self.network_uid):
+            super(ReconfigurationStrategyMixin,self).receive_accept(from_uid, instance_number, proposal_id, proposal_value)
+
+    def receive_nack(self, from_uid, instance_number, proposal_id, promised_proposal_id):
+        if self.is_member(from_uid):
+            super(ReconfigurationStrategyMixin,self).receive_nack(from_uid, instance_number, proposal_id, promised_proposal_id)
+
+    def receive_promise(self, from_uid, instance_number, proposal_id, last_accepted_id, last_accepted_value):
+        if self.is_member(from_uid):
+            super(ReconfigurationStrategyMixin,self).receive_promise(from_uid, instance_number, proposal_id,
+                                                                     last_accepted_id, last_accepted_value)
+
+    def receive_accepted(self, from_uid, instance_number, proposal_id, proposal_value):
+        if self.is_member(from_uid):
+            super(ReconfigurationStrategyMixin,self).receive_accepted(from_uid, instance_number, proposal_id, proposal_value)
@@ -0,0 +1,218 @@
+# This module provides a binary trace format for recording the activity of a
+# single server so that it may be replayed offline by 'bench_replay.py'. The
+# Messenger records every message it receives and sends and a TracingRuntime
+# wrapped around the installed runtime records every timer that fires. As all
+# of the server's behavior is driven by these events, replaying them in order
+# into a freshly constructed ReplicatedValue reproduces the server's decisions
+# without any networking or waiting on timers.
+#
+# The trace begins with a JSON header that records the server's configuration,
+# the strategy mixins of its ReplicatedValue class, its command line settings,
+# and the base64-encoded contents of its state file and the snapshot, log, and
+# membership files kept alongside it at the time recording started. Each
+# subsequent record is:
+#
+#    kind (u8), timestamp (f64), payload length (u32), payload
+#
+# All integers are big-endian and the timestamp is the value of time.time() at
+# which the event occurred. The payload of each kind of record is:
+#
+#    RECEIVE - peer_uid, a NUL byte, and the packet received from the peer
+#    CLIENT  - 'ip:port', a NUL byte, and the packet received from a client
+#    SEND    - peer_uid or 'ip:port', a NUL byte, and the packet sent
+#    TIMER   - label of the timer function. See timer_label()
+#
+# Records are buffered in memory and written in blocks so the last few records
+# may be lost if the server crashes.
+#
+import os
+import json
+import time
+import base64
+import struct
+import atexit
+
+from replicated_value import BaseReplicatedValue
+
+
+TRACE_MAGIC = 'PXT1'
+RECORD      = struct.Struct('>BdI')
+
+HEADER, RECEIVE, CLIENT, SEND, TIMER = range(5)
+
+# Suffixes of the files, alongside the state file, that hold the server's state
+STATE_FILE_SUFFIXES = ('', '.snapshot', '.log', '.members')
+
+
+def timer_label(fn):
+    '''
+    Returns a label identifying the function called by a timer. Labels are
+    derived from the location of the function's code so they are the same
+    each time the server is run.
+    '''
+    f    = getattr(fn, 'im_func', fn)
+    code = getattr(f, 'func_code', None)
+
+    if code is None:
+        return getattr(fn, '__name__', type(fn).__name__)
+
+    return '{0}:{1}({2})'.format(os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+
+
+def addr_str(addr):
+    return '{0}:{1}'.format(addr[0], addr[1])
+
+
+def parse_addr(s):
+    host, port = s.rsplit(':', 1)
+    return (host, int(port))
+
+
+
+class TraceRecorder (object):
+
+    def __init__(self, filename, settings=None):
+        '''
+        settings is a dictionary of the server's command line settings that is
+        recorded in the header
+        '''
+        self.settings = settings or dict()
+        self.f        = open(filename, 'wb', 1 << 16)
+        self.f.write(TRACE_MAGIC)
+        atexit.register(self.close)
+
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+
+
+    def record(self, kind, payload):
+        if isinstance(payload, unicode):
+            payload = payload.encode('utf-8')
+        self.f.write( RECORD.pack(kind, time.time(), len(payload)) )
+        self.f.write( payload )
+
+
+    def header(self, uid, addrs, replicated_val, value_cache_size):
+        '''
+        Records the configuration of the server. Must be called before any other
+        records are written.
+        '''
+        files = dict()
+
+        for suffix in STATE_FILE_SUFFIXES:
+            if os.path.exists(replicated_val.state_file + suffix):
+                with open(replicated_val.state_file + suffix, 'rb') as f:
+                    files[suffix] = base64.b64encode(f.read())
+
+        classes = type(replicated_val).__mro__
+        mixins  = [ cls.__name__ for cls in classes[1:classes.index(BaseReplicatedValue)] ]
+
+        self.record(HEADER, json.dumps(dict(uid                = uid,
+                                            addrs              = addrs,
+                                            peers              = replicated_val.peers,
+                                            learners           = list(getattr(replicated_val, 'learners', ())),
+                                            quorum_size        = replicated_val.quorum_size,
+                                            accept_quorum_size = replicated_val.accept_quorum_size,
+                                            value_cache_size   = value_cache_size,
+                                            mixins             = mixins,
+                                            settings           = self.settings,
+                                            files              = files)))
+
+
+    def received(self, from_uid, packet):
+        self.record(RECEIVE, from_uid + '\x00' + packet)
+
+
+    def client_request(self, from_addr, packet):
+        self.record(CLIENT, addr_str(from_addr) + '\x00' + packet)
+
+
+    def sent(self, to, packet):
+        if isinstance(to, tuple):
+            to = addr_str(to)
+        self.record(SEND, to + '\x00' + packet)
+
+
+    def timer(self, label):
+        self.record(TIMER, label)
+
+
+
+class TraceReader (object):
+    '''
+    Iterates over the (kind, timestamp, payload) records of a trace. The header
+    is decoded on construction and is available as the 'header' attribute.
+    '''
+
+    def __init__(self, filename):
+        self.f = open(filename, 'rb')
+
+        if self.f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError('Invalid trace file: ' + filename)
+
+        kind, self.start_time, payload = next(self, (None, None, None))
+
+        if kind != HEADER:
+            raise ValueError('Trace file is missing its header: ' + filename)
+
+        self.header = json.loads(payload)
+
+
+    def __iter__(self):
+        return self
+
+
+    def next(self):
+        h = self.f.read(RECORD.size)
+
+        if len(h) < RECORD.size:
+            raise StopIteration
+
+        kind, timestamp, length = RECORD.unpack(h)
+
+        payload = self.f.read(length)
+
+        if len(payload) < length:
+            raise StopIteration # Truncated by a crash
+
+        return kind, timestamp, payload
+
+    __next__ = next
+
+
+
+class TracingRuntime (object):
+    '''
+    Wraps a runtime so that each timer firing is recorded before the timer
+    function is called. The initial call made by a looping call started with
+    now=True is not recorded as it occurs within the event that started it.
+    '''
+
+    def __init__(self, rt, recorder):
+        self.rt       = rt
+        self.recorder = recorder
+
+
+    def _wrap(self, fn):
+        label = timer_label(fn)
+        def fire(*args):
+            self.recorder.timer(label)
+            return fn(*args)
+        return fire
+
+
+    def call_later(self, delay, fn, *args):
+        return self.rt.call_later(delay, self._wrap(fn), *args)
+
+
+    def looping_call(self, interval, fn, now=True):
+        lc = self.rt.looping_call(interval, self._wrap(fn), False)
+        if now:
+            fn() # The initial call is part of the current event rather than a timer firing
+        return lc
+
+
+    def __getattr__(self, name):
+        return getattr(self.rt, name)
@@ -1,74 +1,318 @@
 # This module encapsulates the networking strategy for the application. JSON
-# encoded UDP packets are used for all communication.
+# encoded UDP packets are used for all communication. The UDP socket is created
+# through the runtime module so the Messenger may be used with any of the
+# supported event loops.
+#
+# Messages too large to be reliably sent in a single datagram may optionally be
+# sent over persistent stream connections instead. When a stream threshold is
+# provided, all peer messages larger than the threshold are sent via the
+# stream transport and all others continue to use UDP. Client requests and
+# replies always use UDP.
+#
+# When a value cache is enabled, large values are sent to each peer only once.
+# Subsequent messages carry the hash of the value in a '<field>_hash' entry in
+# place of the value itself. Messages received with a hash that is not in the
+# cache are held while the value is fetched from the sender. All peers must use
+# the same setting.
+#
+# When a TraceRecorder is provided, every message received and sent is recorded
+# in a trace file that may be replayed offline by 'bench_replay.py'. See
+# message_trace.py.
+#
+# 'profile' control messages start and stop the profilers defined in
+# profiling.py while the server is running. They are accepted only from the
+# addresses of the configured peers and learners and from the admin hosts.
 #
 
 import json
+import collections
 
-from twisted.internet import reactor, protocol
+import runtime
 
 from composable_paxos import ProposalID
+from stream_transport import StreamTransport
+from value_cache      import ValueCache
+from profiling        import ProfilerControl
+
 
+class Messenger(object):
 
-class Messenger(protocol.DatagramProtocol):
+    transport = None # Set by the runtime prior to calling startProtocol()
 
-    def __init__(self, uid, peer_addresses, replicated_val):
-        self.addrs          = dict(peer_addresses)
-        self.replicated_val = replicated_val
+    value_fields = ('proposal_value', 'last_accepted_value', 'current_value')
+
+    max_awaiting = 64 # Maximum number of values that may be fetched concurrently
+
+    def __init__(self, uid, peer_addresses, replicated_val, stream_threshold=None, value_cache_size=None, trace=None,
+                 admin_hosts=('127.0.0.1',)):
+        self.uid              = uid
+        self.addrs            = dict(peer_addresses)
+        self.replicated_val   = replicated_val
+        self.stream_threshold = stream_threshold
+        self.stream           = None
+        self.cache            = None
+        self.awaiting         = collections.OrderedDict() # value key => list of (from_uid, message_type, kwargs)
+        self.trace            = trace
+        self.profiler_control = ProfilerControl(replicated_val)
+        self.admin_hosts      = set(admin_hosts)
+
+        if value_cache_size is not None:
+            self.cache = ValueCache(value_cache_size)
 
         # provide two-way mapping between endpoints and server names
         for k,v in list(self.addrs.items()):
             self.addrs[v] = k
 
-        reactor.listenUDP( peer_addresses[uid][1], self )
+        if trace is not None:
+            trace.header(uid, peer_addresses, replicated_val, value_cache_size)
+
+        if stream_threshold is not None:
+            self.stream = StreamTransport(uid, peer_addresses[uid][1], self.streamReceived,
+                                          lambda peer_uid: self.addrs[peer_uid])
+
+        runtime.listen_udp( peer_addresses[uid][1], self )
 
         
     def startProtocol(self):
         self.replicated_val.set_messenger(self)
 
+
+    def add_address(self, uid, addr):
+        '''
+        Adds or replaces the address of a peer. Addresses decoded from JSON are
+        lists so they are converted to tuples here.
+        '''
+        addr = (str(addr[0]), int(addr[1]))
+        
+        if self.addrs.get(uid) != addr:
+            self.addrs.pop( self.addrs.get(uid), None )
+            self.addrs[uid]  = addr
+            self.addrs[addr] = uid
+
+            if self.stream is not None:
+                self.stream.address_changed(uid)
+
         
     def datagramReceived(self, packet, from_addr):
+        if self.trace is not None:
+            if from_addr in self.addrs:
+                self.trace.received(self.addrs[from_addr], packet)
+            else:
+                self.trace.client_request(from_addr, packet)
+
         try:
             
             message_type, data = packet.split(' ', 1)
 
             if message_type == 'propose':
 
-                self.replicated_val.propose_update( data )
+                if data.startswith('\x00'):
+                    # Reserved for the internally generated values, such as
+                    # membership changes, patches, and commands, that have
+                    # their own client messages
+                    print 'IGNORING CLIENT PROPOSAL. Values may not begin with a null character'
+                else:
+                    self.replicated_val.propose_update( data )
 
-            else:
-                from_uid = self.addrs[from_addr]
+            elif message_type == 'patch':
+
+                self.replicated_val.propose_patch( json.loads(data) )
+
+            elif message_type == 'read':
+
+                instance_number, current_value, staleness = self.replicated_val.read_value()
 
-                print 'rcv', from_uid, ':', packet
+                self._reply('value {0}'.format(json.dumps(dict(instance_number = instance_number,
+                                                               current_value   = current_value,
+                                                               staleness       = staleness))),
+                            from_addr)
 
-                # Dynamically search the class for a method to handle this message
-                handler = getattr(self.replicated_val, 'receive_' + message_type, None)
+            elif message_type == 'command':
 
-                if handler:
-                    kwargs = json.loads(data)
+                self.replicated_val.propose_command( json.loads(data) )
 
-                    for k in kwargs.keys():
-                        if k.endswith('_id') and kwargs[k] is not None:
-                            # JSON encodes the proposal ids as lists,
-                            # composable-paxos requires requires ProposalID instances
-                            kwargs[k] = ProposalID(*kwargs[k])
-                        
-                    handler(from_uid, **kwargs)
+            elif message_type == 'query':
+
+                instance_number, result, staleness = self.replicated_val.query_state( json.loads(data) )
+
+                self._reply('result {0}'.format(json.dumps(dict(instance_number = instance_number,
+                                                                result          = result,
+                                                                staleness       = staleness))),
+                            from_addr)
+
+            elif message_type == 'reconfigure':
+
+                self.replicated_val.propose_reconfiguration( json.loads(data) )
+
+            elif message_type == 'profile':
+
+                if from_addr not in self.addrs and from_addr[0] not in self.admin_hosts:
+                    print 'IGNORING PROFILE REQUEST. Not from a configured node or admin host:', from_addr
+                    return
+
+                self._reply('profile {0}'.format(json.dumps(self.profiler_control.handle( json.loads(data) ))),
+                            from_addr)
+
+            else:
+                self._dispatch( self.addrs[from_addr], message_type, data, packet )
             
         except Exception:
             print 'Error processing packet: ', packet
             import traceback
             traceback.print_exc()
-            
+
+
+    def streamReceived(self, from_uid, packet):
+        if self.trace is not None:
+            self.trace.received(from_uid, packet)
+
+        try:
+
+            message_type, data = packet.split(' ', 1)
+
+            self._dispatch( from_uid, message_type, data, packet )
+
+        except Exception:
+            print 'Error processing stream message: ', packet[:256]
+            import traceback
+            traceback.print_exc()
+
+
+    def _dispatch(self, from_uid, message_type, data, packet):
+        print 'rcv', from_uid, ':', packet
+
+        kwargs = json.loads(data)
+
+        if message_type == 'fetch_value':
+            self._receive_fetch_value(from_uid, **kwargs)
+        elif message_type == 'value_data':
+            self._receive_value_data(from_uid, **kwargs)
+        else:
+            self._handle(from_uid, message_type, kwargs)
+
+
+    def _handle(self, from_uid, message_type, kwargs):
+        # Dynamically search the class for a method to handle this message
+        handler = getattr(self.replicated_val, 'receive_' + message_type, None)
+
+        if handler:
+            if self.cache is not None and not self._decode_values(from_uid, message_type, kwargs):
+                return
+
+            for k in kwargs.keys():
+                if k.endswith('_id') and kwargs[k] is not None:
+                    # JSON encodes the proposal ids as lists,
+                    # composable-paxos requires requires ProposalID instances
+                    kwargs[k] = ProposalID(*kwargs[k])
+
+            handler(from_uid, **kwargs)
+
+
+    def _decode_values(self, from_uid, message_type, kwargs):
+        '''
+        Replaces value hashes with the cached values. Returns False if a value
+        is missing, in which case the message is held until the value has been
+        fetched from the sender.
+        '''
+        for f in self.value_fields:
+            if f in kwargs:
+                if self.cache.cacheable(kwargs[f]):
+                    self.cache.add(kwargs[f], from_uid)
+
+            elif f + '_hash' in kwargs:
+                key   = kwargs[f + '_hash']
+                value = self.cache.get(key, from_uid)
+
+                if value is None:
+                    self._await_value(key, from_uid, message_type, kwargs)
+                    return False
+
+                del kwargs[f + '_hash']
+                kwargs[f] = value
+
+        return True
+
+
+    def _await_value(self, key, from_uid, message_type, kwargs):
+        l = self.awaiting.get(key)
+
+        if l is None:
+            if len(self.awaiting) >= self.max_awaiting:
+                self.awaiting.popitem(last=False)
+            l = self.awaiting[key] = list()
+
+        # Messages are retransmitted so only a few need to be held
+        if len(l) < 8:
+            l.append( (from_uid, message_type, kwargs) )
+
+        self._send(from_uid, 'fetch_value', key=key)
+
+
+    def _receive_fetch_value(self, from_uid, key):
+        if self.cache is not None:
+            value = self.cache.get(key, from_uid)
+            if value is not None:
+                self._send(from_uid, 'value_data', key=key, value=value)
+
+
+    def _receive_value_data(self, from_uid, key, value):
+        if self.cache is None or self.cache.key_of(value) != key:
+            return
+
+        self.cache.add(value, from_uid)
+
+        for uid, message_type, kwargs in self.awaiting.pop(key, ()):
+            self._handle(uid, message_type, kwargs)
+
+
+    def _encode_values(self, to_uid, kwargs):
+        for f in self.value_fields:
+            value = kwargs.get(f)
+
+            if self.cache.cacheable(value):
+                key = self.cache.add(value, self.uid) # The local peer always holds the value
+
+                if self.cache.peer_has(key, to_uid):
+                    del kwargs[f]
+                    kwargs[f + '_hash'] = key
+                else:
+                    self.cache.add(value, to_uid)
+
 
     def _send(self, to_uid, message_type, **kwargs):
+        if self.cache is not None:
+            self._encode_values(to_uid, kwargs)
+
         msg = '{0} {1}'.format(message_type, json.dumps(kwargs))
         print 'snd', to_uid, ':', msg
-        self.transport.write(msg, self.addrs[to_uid])
+
+        if self.trace is not None:
+            self.trace.sent(to_uid, msg)
+
+        if self.stream is not None and len(msg) > self.stream_threshold:
+            self.stream.send(to_uid, msg)
+        else:
+            self.transport.write(msg, self.addrs[to_uid])
+
+
+    def _reply(self, msg, client_addr):
+        if self.trace is not None:
+            self.trace.sent(client_addr, msg)
+
+        self.transport.write(msg, client_addr)
 
 
     def send_sync_request(self, peer_uid, instance_number):
         self._send(peer_uid, 'sync_request', instance_number=instance_number)
 
+    def send_sync_ack(self, peer_uid, instance_number):
+        self._send(peer_uid, 'sync_ack', instance_number=instance_number)
+
+    def send_membership(self, peer_uid, instance_number, members, pending):
+        self._send(peer_uid, 'membership', instance_number = instance_number,
+                                           members         = members,
+                                           pending         = pending)
+
     def send_catchup(self, peer_uid, instance_number, current_value):
         self._send(peer_uid, 'catchup', instance_number = instance_number,
                                         current_value   = current_value)
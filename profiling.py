@@ -0,0 +1,228 @@
+# This module provides profilers that may be started and stopped in a running
+# server via 'profile' control messages sent to its Messenger. This allows a
+# server that has become slow to be profiled without restarting it and losing
+# the condition that caused the slowdown. Two profilers are provided:
+#
+#    * SamplingProfiler - A background thread records the stack of the event
+#                         loop thread at a fixed interval. The overhead is a
+#                         brief stack walk per sample, independent of the
+#                         amount of work the server is doing.
+#
+#    * HandlerProfiler  - Times every call to the replicated value's receive_*
+#                         handlers and save_state(). Each method is wrapped
+#                         while the profiler runs and the wrappers are removed
+#                         when it stops.
+#
+# Both write their results in the collapsed stack format, one stack per line
+# with frames separated by semicolons and followed by a count, which may be
+# passed directly to flamegraph.pl and similar tools. The counts are samples
+# for the SamplingProfiler and microseconds of time spent in each handler,
+# excluding that spent in nested handlers, for the HandlerProfiler.
+#
+# Nothing is installed or running while the profilers are stopped so they have
+# no cost unless in use.
+#
+# Profile requests can write files and add load, so the Messenger accepts them
+# only from configured peers and admin hosts. The output files are always
+# written to the directory holding the server's state file under names chosen
+# by the server.
+#
+import os
+import sys
+import time
+import thread
+import threading
+import collections
+
+
+def write_collapsed(filename, counts):
+    tmp = filename + '.tmp'
+
+    with open(tmp, 'w') as f:
+        for stack, count in sorted(counts.iteritems()):
+            if count > 0:
+                f.write('{0} {1}\n'.format(stack, count))
+
+    os.rename(tmp, filename)
+
+
+
+class SamplingProfiler (object):
+
+    def __init__(self, filename, interval=0.01, thread_id=None):
+        '''
+        interval is the time between samples in seconds. The thread that
+        creates the profiler is sampled unless thread_id is provided.
+        '''
+        self.filename  = filename
+        self.interval  = interval
+        self.thread_id = thread_id if thread_id is not None else thread.get_ident()
+        self.counts    = collections.defaultdict(int) # collapsed stack => number of samples
+        self.labels    = dict()                       # code object => frame label
+        self.samples   = 0
+        self.running   = False
+        self.sampler   = None
+
+
+    def start(self):
+        self.running = True
+        self.sampler = threading.Thread(target=self.run, name='SamplingProfiler')
+        self.sampler.daemon = True
+        self.sampler.start()
+
+
+    def stop(self):
+        '''
+        Stops sampling, writes the collapsed stacks, and returns the number of
+        samples taken
+        '''
+        self.running = False
+        self.sampler.join()
+        write_collapsed(self.filename, self.counts)
+        return self.samples
+
+
+    def label(self, code):
+        l = self.labels.get(code)
+        if l is None:
+            l = self.labels[code] = '{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                            code.co_firstlineno)
+        return l
+
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+
+            frame = sys._current_frames().get(self.thread_id)
+            stack = list()
+
+            while frame is not None:
+                stack.append( self.label(frame.f_code) )
+                frame = frame.f_back
+
+            if stack:
+                stack.reverse()
+                self.counts[ ';'.join(stack) ] += 1
+                self.samples += 1
+
+
+
+class HandlerProfiler (object):
+
+    def __init__(self, filename, target):
+        self.filename = filename
+        self.target   = target
+        self.names    = [ name for name in dir(target)
+                          if (name.startswith('receive_') or name == 'save_state') and callable(getattr(target, name)) ]
+        self.totals   = collections.defaultdict(float) # collapsed stack => seconds
+        self.calls    = 0
+        self.active   = list()                         # [collapsed stack, seconds spent in nested handlers]
+
+
+    def start(self):
+        for name in self.names:
+            setattr(self.target, name, self.wrap(name, getattr(self.target, name)))
+
+
+    def stop(self):
+        '''
+        Removes the wrappers, writes the collapsed stacks, and returns the number
+        of handler calls timed
+        '''
+        for name in self.names:
+            delattr(self.target, name)
+
+        write_collapsed(self.filename, dict( (stack, int(t * 1e6)) for stack, t in self.totals.iteritems() ))
+
+        return self.calls
+
+
+    def wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            stack = self.active[-1][0] + ';' + name if self.active else name
+            entry = [stack, 0.0]
+
+            self.active.append(entry)
+            start = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.time() - start
+                self.active.pop()
+                self.totals[stack] += elapsed - entry[1]
+                self.calls         += 1
+                if self.active:
+                    self.active[-1][1] += elapsed
+        return timed
+
+
+
+class ProfilerControl (object):
+    '''
+    Handles the 'profile' control messages received by the Messenger. Requests
+    are dictionaries of the form:
+
+        {"action": "start", "mode": "sample"|"handlers", "interval": <milliseconds>}
+        {"action": "stop",  "mode": "sample"|"handlers"}
+
+    The mode defaults to "sample" and the interval to 10 milliseconds. The
+    interval must be between min_interval and max_interval. Results are
+    written to '<uid>.<mode>.<timestamp>.folded' in the directory of the state
+    file. Requests may not name the file. A stop request without a mode stops
+    all running profilers. The reply lists the running profilers and, for
+    those that were stopped, the files written and number of samples or calls
+    recorded.
+    '''
+
+    min_interval = 1    # milliseconds
+    max_interval = 1000 # milliseconds
+
+    def __init__(self, replicated_val):
+        self.replicated_val = replicated_val
+        self.output_dir     = os.path.dirname(os.path.abspath(replicated_val.state_file))
+        self.profilers      = dict() # mode => profiler
+
+
+    def output_file(self, mode):
+        return os.path.join(self.output_dir, '{0}.{1}.{2}.folded'.format(self.replicated_val.network_uid, mode,
+                                                                        time.strftime('%Y%m%d-%H%M%S')))
+
+
+    def handle(self, request):
+        action  = request.get('action')
+        mode    = request.get('mode')
+        written = dict()
+
+        if action == 'start':
+            mode     = mode or 'sample'
+            interval = request.get('interval', 10)
+
+            if 'file' in request:
+                return dict(error = 'Output files are named by the server')
+
+            if not (isinstance(interval, (int, long, float)) and self.min_interval <= interval <= self.max_interval):
+                return dict(error = 'The interval must be between {0} and {1} milliseconds'.format(self.min_interval,
+                                                                                                  self.max_interval))
+            if mode not in self.profilers:
+                filename = self.output_file(mode)
+
+                if mode == 'sample':
+                    p = SamplingProfiler(filename, interval / 1000.0)
+                elif mode == 'handlers':
+                    p = HandlerProfiler(filename, self.replicated_val)
+                else:
+                    return dict(error = 'Unknown profiler mode: {0}'.format(mode))
+
+                p.start()
+                self.profilers[mode] = p
+
+        elif action == 'stop':
+            for m in ([mode] if mode else self.profilers.keys()):
+                p = self.profilers.pop(m, None)
+                if p is not None:
+                    written[m] = dict(file = p.filename, count = p.stop())
+        else:
+            return dict(error = 'Unknown profiler action: {0}'.format(action))
+
+        return dict(running = sorted(self.profilers.keys()), written = written)
@@ -16,25 +16,73 @@ import json
 import random
 import os.path
 
-from twisted.internet import reactor, defer, task
+from composable_paxos import PaxosInstance, ProposalID, peer_bits, Prepare, Nack, Promise, Accept, Accepted, Resolution
+
+
+class Unchanged (object):
+    '''
+    Passed to save_state() and advance_instance() in place of the current value
+    when it has not changed. Mixins that compute the current value on demand
+    need not materialize it merely to pass it back.
+    '''
+    def __repr__(self):
+        return '<unchanged>'
+
+UNCHANGED = Unchanged()
+
+
+def quorum_sizes(num_peers, quorum_size=None, accept_quorum_size=None):
+    '''
+    Returns a (quorum_size, accept_quorum_size) tuple for a cluster of
+    num_peers acceptors. Missing values are filled in with their defaults and
+    a ValueError is raised if the two quorums are not guaranteed to intersect.
+    '''
+    if quorum_size is None and accept_quorum_size is None:
+        quorum_size        = num_peers/2 + 1
+        accept_quorum_size = quorum_size
+    elif quorum_size is None:
+        quorum_size        = num_peers - accept_quorum_size + 1
+    elif accept_quorum_size is None:
+        accept_quorum_size = num_peers - quorum_size + 1
+
+    if not (0 < quorum_size <= num_peers and 0 < accept_quorum_size <= num_peers):
+        raise ValueError('Quorum sizes must be between 1 and the number of peers ({0})'.format(num_peers))
+
+    if quorum_size + accept_quorum_size <= num_peers:
+        raise ValueError('The sum of the phase 1 and phase 2 quorum sizes ({0} + {1}) must exceed '
+                         'the number of peers ({2})'.format(quorum_size, accept_quorum_size, num_peers))
+
+    return quorum_size, accept_quorum_size
 
-from composable_paxos import PaxosInstance, ProposalID, Prepare, Nack, Promise, Accept, Accepted, Resolution
 
 
 class BaseReplicatedValue (object):
 
-    def __init__(self, network_uid, peers, state_file):
+    def __init__(self, network_uid, peers, state_file, quorum_size=None, accept_quorum_size=None):
+        '''
+        quorum_size and accept_quorum_size are the number of peers required to
+        complete phase 1 (Prepare/Promise) and phase 2 (Accept/Accepted) of the
+        Paxos algorithm, respectively. Both default to a simple majority. As
+        described by Flexible Paxos, any sizes may be used so long as every
+        phase 1 quorum intersects every phase 2 quorum. When a dedicated master
+        is used, phase 1 is rarely needed so a larger phase 1 quorum may be
+        traded for a smaller, faster phase 2 quorum. If only one size is
+        provided, the other defaults to the smallest valid size.
+        '''
         self.messenger   = None
         self.network_uid = network_uid
         self.peers       = peers            # list of peer network uids
-        self.quorum_size = len(peers)/2 + 1
+        self.uid_bits    = peer_bits(peers) # maps peer uids to quorum bitmask values
         self.state_file  = state_file
 
+        self.quorum_size, self.accept_quorum_size = quorum_sizes(len(peers), quorum_size, accept_quorum_size)
+
         self.load_state()
 
         self.paxos = PaxosInstance(self.network_uid, self.quorum_size,
                                    self.promised_id, self.accepted_id,
-                                   self.accepted_value)
+                                   self.accepted_value, self.uid_bits,
+                                   self.accept_quorum_size)
 
 
     def set_messenger(self, messenger):
@@ -48,6 +96,9 @@ class BaseReplicatedValue (object):
         also save the state of the multi-paxos chain here so everything is kept
         in one place.
         '''
+        if current_value is UNCHANGED:
+            current_value = self.current_value
+
         self.instance_number = instance_number
         self.current_value   = current_value
         self.promised_id     = promised_id
@@ -95,6 +146,22 @@ class BaseReplicatedValue (object):
             self.accepted_value  = m['accepted_value']
 
 
+    def read_value(self):
+        '''
+        Returns a (instance_number, current_value, staleness) tuple. See staleness()
+        '''
+        return self.instance_number, self.current_value, self.staleness()
+
+
+    def staleness(self):
+        '''
+        Returns an upper bound, in seconds, on how out of date the value may be or
+        None if no bound is known. Voting peers may fall behind without being
+        aware of it so this implementation does not provide a bound.
+        '''
+        return None
+
+        
     def propose_update(self, new_value):
         """
         This is a key method that some of the mixin classes override in order
@@ -106,8 +173,11 @@ class BaseReplicatedValue (object):
 
     def advance_instance(self, new_instance_number, new_current_value, catchup=False):
         self.save_state(new_instance_number, new_current_value, None, None, None)
-        
-        self.paxos = PaxosInstance(self.network_uid, self.quorum_size, None, None, None)
+
+        # Recycle the PaxosInstance object for the new link in the chain rather than
+        # allocating a new one. Mixin classes may carry the promise over to the new
+        # instance via save_state().
+        self.paxos.reset(self.promised_id, None, None)
 
         print 'UPDATED: ', new_instance_number, new_current_value
 
@@ -135,7 +205,7 @@ class BaseReplicatedValue (object):
         m = self.paxos.receive_prepare( Prepare(from_uid, proposal_id) )
         
         if isinstance(m, Promise):
-            self.save_state(self.instance_number, self.current_value, m.proposal_id,
+            self.save_state(self.instance_number, UNCHANGED, m.proposal_id,
                             m.last_accepted_id, m.last_accepted_value)
             
             self.messenger.send_promise(from_uid, self.instance_number,
@@ -172,7 +242,7 @@ class BaseReplicatedValue (object):
         m = self.paxos.receive_accept( Accept(from_uid, proposal_id, proposal_value) )
         
         if isinstance(m, Accepted):
-            self.save_state(self.instance_number, self.current_value, self.promised_id,
+            self.save_state(self.instance_number, UNCHANGED, self.paxos.promised_id,
                             proposal_id, proposal_value)
             self.send_accepted(m.proposal_id, m.proposal_value)
         else:
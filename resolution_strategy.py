@@ -9,7 +9,7 @@
 #
 import random
 
-from twisted.internet import reactor, defer, task
+import runtime
 
 
 class ExponentialBackoffResolutionStrategyMixin (object):
@@ -29,7 +29,7 @@ class ExponentialBackoffResolutionStrategyMixin (object):
         if self.delayed_drive is not None and self.delayed_drive.active():
             self.delayed_drive.cancel()
             
-        self.delayed_drive = reactor.callLater(delay, self.drive_to_resolution)
+        self.delayed_drive = runtime.call_later(delay, self.drive_to_resolution)
 
         
     def drive_to_resolution(self):
@@ -37,8 +37,8 @@ class ExponentialBackoffResolutionStrategyMixin (object):
         
         m = self.paxos.prepare() # Advances to the next proposal number
 
-        self.retransmit_task = task.LoopingCall( lambda : self.send_prepare(m.proposal_id) )
-        self.retransmit_task.start( self.retransmit_interval/1000.0, now=True )
+        self.retransmit_task = runtime.looping_call( self.retransmit_interval/1000.0,
+                                                     lambda : self.send_prepare(m.proposal_id) )
 
         
     def stop_driving(self):
@@ -70,8 +70,8 @@ class ExponentialBackoffResolutionStrategyMixin (object):
         if self.retransmit_task is not None:
             self.retransmit_task.stop()
 
-        self.retransmit_task = task.LoopingCall( lambda : super(ExponentialBackoffResolutionStrategyMixin,self).send_accept(proposal_id, proposal_value) )
-        self.retransmit_task.start( self.retransmit_interval, now=True )
+        self.retransmit_task = runtime.looping_call( self.retransmit_interval/1000.0,
+                                                     lambda : super(ExponentialBackoffResolutionStrategyMixin,self).send_accept(proposal_id, proposal_value) )
 
         
     def receive_accept(self, from_uid, instance_number, proposal_id, proposal_value):
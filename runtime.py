@@ -0,0 +1,332 @@
+# This module isolates the rest of the application from the event loop
+# implementation. All timers and sockets are created through the functions
+# defined at the bottom of this module which forward the calls to the installed
+# runtime. Two runtimes are provided:
+#
+#    * TwistedRuntime - Uses the Twisted reactor. This is the default.
+#    * AsyncioRuntime - Uses the asyncio event loop obtained from the current
+#                       event loop policy. Alternative loop implementations,
+#                       such as uvloop, may be used by installing their policy
+#                       prior to creating the runtime. On Python 2 the trollius
+#                       backport of asyncio is used.
+#
+# Datagram protocols passed to listen_udp() use the same callbacks as Twisted's
+# DatagramProtocol: startProtocol() is called once the socket is ready, incoming
+# packets are delivered to datagramReceived(packet, from_addr), and packets are
+# sent via self.transport.write(packet, to_addr).
+#
+# Similarly, stream protocols passed to connect_tcp() or created by the factory
+# function passed to listen_tcp() use the callbacks of Twisted's Protocol:
+# connectionMade(), dataReceived(data), and connectionLost(). connectionLost() is
+# also called if an outbound connection attempt fails. Data is sent via
+# self.transport.writeSequence(list_of_strings), which avoids concatenating the
+# strings prior to sending them, and the connection is closed via
+# self.transport.loseConnection().
+#
+
+
+class TwistedRuntime (object):
+
+    def __init__(self):
+        from twisted.internet import reactor, task, protocol
+
+        class DatagramAdapter (protocol.DatagramProtocol):
+            def __init__(self, proto):
+                self.proto = proto
+
+            def startProtocol(self):
+                self.proto.transport = self.transport
+                self.proto.startProtocol()
+
+            def datagramReceived(self, packet, from_addr):
+                self.proto.datagramReceived(packet, from_addr)
+
+        class StreamAdapter (protocol.Protocol):
+            def __init__(self, proto):
+                self.proto = proto
+
+            def connectionMade(self):
+                self.proto.transport = self.transport
+                self.proto.connectionMade()
+
+            def dataReceived(self, data):
+                self.proto.dataReceived(data)
+
+            def connectionLost(self, reason):
+                self.proto.connectionLost()
+
+        class ServerFactory (protocol.ServerFactory):
+            def __init__(self, proto_factory):
+                self.proto_factory = proto_factory
+
+            def buildProtocol(self, addr):
+                return StreamAdapter( self.proto_factory() )
+
+        class ClientFactory (protocol.ClientFactory):
+            def __init__(self, proto):
+                self.proto = proto
+
+            def buildProtocol(self, addr):
+                return StreamAdapter( self.proto )
+
+            def clientConnectionFailed(self, connector, reason):
+                self.proto.connectionLost()
+
+        self.reactor          = reactor
+        self.task             = task
+        self.DatagramAdapter  = DatagramAdapter
+        self.ServerFactory    = ServerFactory
+        self.ClientFactory    = ClientFactory
+
+
+    def call_later(self, delay, fn, *args):
+        return self.reactor.callLater(delay, fn, *args)
+
+
+    def looping_call(self, interval, fn, now=True):
+        lc = self.task.LoopingCall(fn)
+        lc.start(interval, now=now)
+        return lc
+
+
+    def listen_udp(self, port, proto):
+        self.reactor.listenUDP(port, self.DatagramAdapter(proto))
+
+
+    def listen_tcp(self, port, proto_factory):
+        self.reactor.listenTCP(port, self.ServerFactory(proto_factory))
+
+
+    def connect_tcp(self, host, port, proto):
+        self.reactor.connectTCP(host, port, self.ClientFactory(proto))
+
+
+    def run(self):
+        self.reactor.run()
+
+
+    def stop(self):
+        self.reactor.stop()
+
+
+
+class AsyncioDelayedCall (object):
+    '''
+    Wraps an asyncio TimerHandle to provide the active() and cancel() methods
+    of Twisted's DelayedCall
+    '''
+    def __init__(self, loop, delay, fn, args):
+        self.fn      = fn
+        self.args    = args
+        self.done    = False
+        self.handle  = loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        self.done = True
+        self.fn(*self.args)
+
+    def active(self):
+        return not self.done
+
+    def cancel(self):
+        self.done = True
+        self.handle.cancel()
+
+
+
+class AsyncioLoopingCall (object):
+    '''
+    Provides the stop() method of Twisted's LoopingCall. As with Twisted, the
+    interval is measured from the scheduled start of each call so the period
+    does not drift, and calls missed while the loop was blocked are skipped
+    rather than run back to back.
+    '''
+    def __init__(self, loop, interval, fn, now):
+        self.loop     = loop
+        self.interval = interval
+        self.fn       = fn
+        self.running  = True
+        self.next     = loop.time()
+        self.handle   = None
+
+        if now:
+            self._fire()
+        else:
+            self._schedule()
+
+    def _schedule(self):
+        now = self.loop.time()
+
+        self.next += self.interval
+
+        if self.next <= now:
+            if self.interval > 0:
+                # Skip to the first multiple of the interval that is still in the future
+                self.next += self.interval * (int((now - self.next) / self.interval) + 1)
+            else:
+                self.next = now
+
+        self.handle = self.loop.call_at(self.next, self._fire)
+
+    def _fire(self):
+        self.fn()
+        if self.running:
+            self._schedule()
+
+    def stop(self):
+        self.running = False
+        if self.handle is not None:
+            self.handle.cancel()
+
+
+
+class AsyncioRuntime (object):
+
+    def __init__(self, loop=None):
+        try:
+            import asyncio
+        except ImportError:
+            import trollius as asyncio
+
+        class DatagramAdapter (asyncio.DatagramProtocol):
+            def __init__(self, proto):
+                self.proto = proto
+
+            def connection_made(self, transport):
+                self.proto.transport = AsyncioTransport(transport)
+                self.proto.startProtocol()
+
+            def datagram_received(self, packet, from_addr):
+                self.proto.datagramReceived(packet, from_addr)
+
+        class AsyncioTransport (object):
+            def __init__(self, transport):
+                self.write = transport.sendto
+
+        class StreamAdapter (asyncio.Protocol):
+            def __init__(self, proto):
+                self.proto = proto
+
+            def connection_made(self, transport):
+                self.proto.transport = AsyncioStreamTransport(transport)
+                self.proto.connectionMade()
+
+            def data_received(self, data):
+                self.proto.dataReceived(data)
+
+            def connection_lost(self, exc):
+                self.proto.connectionLost()
+
+        class AsyncioStreamTransport (object):
+            def __init__(self, transport):
+                self.writeSequence  = transport.writelines
+                self.loseConnection = transport.close
+
+        self.asyncio         = asyncio
+        self.loop            = loop if loop is not None else asyncio.get_event_loop()
+        self.DatagramAdapter = DatagramAdapter
+        self.StreamAdapter   = StreamAdapter
+
+
+    def call_later(self, delay, fn, *args):
+        return AsyncioDelayedCall(self.loop, delay, fn, args)
+
+
+    def looping_call(self, interval, fn, now=True):
+        return AsyncioLoopingCall(self.loop, interval, fn, now)
+
+
+    def listen_udp(self, port, proto):
+        self._start( self.loop.create_datagram_endpoint(lambda : self.DatagramAdapter(proto),
+                                                        local_addr=('0.0.0.0', port)) )
+
+
+    def listen_tcp(self, port, proto_factory):
+        self._start( self.loop.create_server(lambda : self.StreamAdapter(proto_factory()), '0.0.0.0', port) )
+
+
+    def connect_tcp(self, host, port, proto):
+        def done(future):
+            if future.cancelled() or future.exception() is not None:
+                proto.connectionLost()
+
+        f = self.asyncio.ensure_future(self.loop.create_connection(lambda : self.StreamAdapter(proto), host, port),
+                                       loop=self.loop)
+        f.add_done_callback(done)
+
+
+    def _start(self, coro):
+        if self.loop.is_running():
+            self.asyncio.ensure_future(coro, loop=self.loop)
+        else:
+            self.loop.run_until_complete(coro)
+
+
+    def run(self):
+        self.loop.run_forever()
+
+
+    def stop(self):
+        self.loop.stop()
+
+
+
+runtimes = dict( twisted = TwistedRuntime,
+                 asyncio = AsyncioRuntime )
+
+_runtime = None
+
+
+def install(rt):
+    '''
+    Sets the runtime used by all subsequent calls to the functions below. This
+    must be called before any timers or sockets are created.
+    '''
+    global _runtime
+    _runtime = rt
+
+
+def get():
+    '''
+    Returns the installed runtime. The Twisted runtime is installed if no other
+    runtime has been.
+    '''
+    if _runtime is None:
+        install( TwistedRuntime() )
+    return _runtime
+
+
+def call_later(delay, fn, *args):
+    '''
+    Calls fn(*args) after delay seconds. Returns an object with active() and
+    cancel() methods.
+    '''
+    return get().call_later(delay, fn, *args)
+
+
+def looping_call(interval, fn, now=True):
+    '''
+    Calls fn() every interval seconds, starting immediately if now is True.
+    Returns an object with a stop() method.
+    '''
+    return get().looping_call(interval, fn, now)
+
+
+def listen_udp(port, proto):
+    get().listen_udp(port, proto)
+
+
+def listen_tcp(port, proto_factory):
+    get().listen_tcp(port, proto_factory)
+
+
+def connect_tcp(host, port, proto):
+    get().connect_tcp(host, port, proto)
+
+
+def run():
+    get().run()
+
+
+def stop():
+    get().stop()
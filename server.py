@@ -3,46 +3,109 @@ import os.path
 import argparse
 import json
 
-from twisted.internet import reactor
-
 this_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append( os.path.dirname(this_dir) )
 
 import config
+import runtime
 
 from replicated_value    import BaseReplicatedValue
 from messenger           import Messenger
 from sync_strategy       import SimpleSynchronizationStrategyMixin
 from resolution_strategy import ExponentialBackoffResolutionStrategyMixin
 from master_strategy     import DedicatedMasterStrategyMixin
+from learner_strategy    import LearnerPublisherMixin, LearnerReplicaMixin
+from membership_strategy import ReconfigurationStrategyMixin
+from delta_strategy      import DeltaStrategyMixin
+from state_machine       import StateMachineMixin
+from snapshot_strategy   import SnapshotStrategyMixin
+from thrifty_strategy    import ThriftyAcceptStrategyMixin
+from kv_store            import KeyValueStore
+from message_trace       import TraceRecorder, TracingRuntime
 
 
 p = argparse.ArgumentParser(description='Multi-Paxos replicated value server')
-p.add_argument('uid', choices=['A', 'B', 'C'], help='UID of the server. Must be A, B, or C')
+p.add_argument('uid', help='UID of the server. Must be one of the peers or learners defined in the configuration (A, B, or C by default)')
 p.add_argument('--master', action='store_true', help='If specified, a dedicated master will be used. If one server specifies this flag, all must')
+p.add_argument('--config', metavar='FILE', help='JSON file defining the peers and quorum sizes. See config.load() for the format')
+p.add_argument('--runtime', choices=sorted(runtime.runtimes.keys()), default='twisted', help='Event loop implementation to use. Defaults to twisted')
+p.add_argument('--stream-threshold', metavar='BYTES', type=int, help='If specified, peer messages larger than this are sent over persistent TCP connections rather than UDP')
+p.add_argument('--value-cache', metavar='ENTRIES', type=int, help='If specified, large values are sent to each peer once and referred to by hash thereafter. If one server specifies this flag, all must')
+p.add_argument('--kv', action='store_true', help='If specified, the chain replicates a key-value store rather than a single value. If one server specifies this flag, all must')
+p.add_argument('--thrifty', action='store_true', help='If specified, Accept messages are sent only to the fastest phase 2 quorum and to the remaining peers if it does not respond promptly')
+p.add_argument('--trace', metavar='FILE', help='If specified, all messages received and sent and all timer firings are recorded in FILE for offline replay by bench_replay.py')
+p.add_argument('--join', action='store_true', help='If specified, the server is being added to a running chain and will not vote until a membership change that includes it takes effect')
 
 args = p.parse_args()
 
+# The runtime must be installed before any timers or sockets are created
+runtime.install( runtime.runtimes[args.runtime]() )
+
+trace = None
+
+if args.trace:
+    trace = TraceRecorder(args.trace, dict(master = args.master, kv = args.kv, thrifty = args.thrifty))
+    runtime.install( TracingRuntime(runtime.get(), trace) )
+
+if args.config:
+    config.load(args.config)
+
+if args.uid not in config.all_nodes():
+    p.error('UID must be one of: ' + ', '.join(sorted(config.all_nodes().keys())))
+
+
+if args.kv:
+
+    class UpdateStrategyMixin(SnapshotStrategyMixin, StateMachineMixin):
+        '''
+        Links in the chain are commands applied to a replicated key-value store. The store is persisted
+        as memory-mapped snapshots and a log of the commands applied since the last snapshot
+        '''
+        state_machine_class = KeyValueStore
+else:
+
+    # Links in the chain are either full values or patches to the current value
+    UpdateStrategyMixin = DeltaStrategyMixin
 
-if args.master:
 
-    class ReplicatedValue(DedicatedMasterStrategyMixin, ExponentialBackoffResolutionStrategyMixin, SimpleSynchronizationStrategyMixin, BaseReplicatedValue):
+if args.uid in config.learners:
+
+    class ReplicatedValue(LearnerReplicaMixin, UpdateStrategyMixin, SimpleSynchronizationStrategyMixin, BaseReplicatedValue):
         '''
-        Mixes the dedicated master, resolution, and synchronization strategies into the base class
+        Learner replicas only need the synchronization strategy to keep up to date with the voting peers. The
+        update strategy is included so that learners may answer queries
         '''
+        
+elif args.master:
+
+    class ReplicatedValue(DedicatedMasterStrategyMixin, ReconfigurationStrategyMixin, UpdateStrategyMixin, ExponentialBackoffResolutionStrategyMixin, ThriftyAcceptStrategyMixin, LearnerPublisherMixin, SimpleSynchronizationStrategyMixin, BaseReplicatedValue):
+        '''
+        Mixes the dedicated master, reconfiguration, update, resolution, thrifty accept, learner publishing, and synchronization strategies into the base class
+        '''
+        learners = config.learners.keys()
+        thrifty  = args.thrifty
 else:
     
-    class ReplicatedValue(ExponentialBackoffResolutionStrategyMixin, SimpleSynchronizationStrategyMixin, BaseReplicatedValue):
+    class ReplicatedValue(ReconfigurationStrategyMixin, UpdateStrategyMixin, ExponentialBackoffResolutionStrategyMixin, ThriftyAcceptStrategyMixin, LearnerPublisherMixin, SimpleSynchronizationStrategyMixin, BaseReplicatedValue):
         '''
-        Mixes just the resolution and synchronization strategies into the base class
+        Mixes just the reconfiguration, update, resolution, thrifty accept, learner publishing, and synchronization strategies into the base class
         '''
+        learners = config.learners.keys()
+        thrifty  = args.thrifty
 
 
 state_file = config.state_files[args.uid]
 
+peers      = config.peers.keys()
+
+if args.join:
+    # The membership is learned from the running chain. Until then, this server
+    # is not a member.
+    peers = [ uid for uid in peers if uid != args.uid ]
+
 
-r = ReplicatedValue(args.uid, config.peers.keys(), state_file)
-m = Messenger(args.uid, config.peers, r)
+r = ReplicatedValue(args.uid, peers, state_file, config.quorum_size, config.accept_quorum_size)
+m = Messenger(args.uid, config.all_nodes(), r, args.stream_threshold, args.value_cache, trace, config.admin_hosts)
 
-reactor.run()
+runtime.run()
 
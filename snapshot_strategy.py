@@ -0,0 +1,171 @@
+# This module provides a Mixin class that persists the state of a
+# StateMachineMixin state machine as periodic binary snapshots plus a log of the
+# commands applied since the most recent snapshot. Without it, the state file
+# holds a full copy of the state that is rewritten on every update and parsed
+# in its entirety at startup.
+#
+# Each resolved command is appended to the log before the state file records the
+# new instance number. Every snapshot_interval commands, the state machine is
+# written to a new snapshot file and the log is emptied. At startup, the
+# snapshot is opened, which for state machines such as KeyValueStore memory-maps
+# the file rather than reading it, and only the commands in the log are
+# replayed. Startup time and memory use therefore depend on the length of the
+# log rather than the size of the state.
+#
+# As the log and snapshot are written prior to the state file, they may be
+# ahead of it following a crash. Their contents were resolved by the chain so
+# the instance number is advanced to match them on startup.
+#
+# The state file no longer holds the value. The current value sent in catchup
+# messages and returned by reads is encoded from the state machine on demand
+# and cached until the next command is applied. Code paths that only carry the
+# value forward, such as saving a promise or advancing past a lease grant, pass
+# replicated_value.UNCHANGED rather than reading the current_value property.
+#
+# The state machine must provide save_snapshot(filename, instance_number) and
+# open_snapshot(filename), which returns the instance number of the snapshot.
+# This mixin must precede StateMachineMixin in the inheritance order.
+#
+import os
+import json
+
+from state_machine import apply_safely
+
+
+class SnapshotStrategyMixin (object):
+
+    snapshot_interval = 1000 # Number of commands between snapshots
+
+    log_entries       = 0
+    cached_value      = None
+    snapshot_loaded   = False
+
+
+    def snapshot_file(self):
+        return self.state_file + '.snapshot'
+
+
+    def log_file(self):
+        return self.state_file + '.log'
+
+
+    def write_snapshot(self, instance_number):
+        tmp = self.snapshot_file() + '.tmp'
+
+        self.state_machine.save_snapshot(tmp, instance_number)
+
+        os.rename(tmp, self.snapshot_file())
+
+        # Commands in the log are now included in the snapshot
+        with open(self.log_file(), 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.state_machine.open_snapshot(self.snapshot_file())
+
+        self.log_entries = 0
+
+
+    def append_log(self, instance_number, command):
+        with open(self.log_file(), 'a') as f:
+            f.write( json.dumps([instance_number, command]) + '\n' )
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.log_entries += 1
+
+
+    def replay_log(self, snapshot_instance):
+        '''
+        Applies the logged commands that follow the snapshot and returns the
+        instance number of the last one
+        '''
+        instance_number = snapshot_instance
+
+        if not os.path.exists(self.log_file()):
+            return instance_number
+
+        with open(self.log_file()) as f:
+            for line in f:
+                try:
+                    n, command = json.loads(line)
+                except ValueError:
+                    continue # Partially written entry left by a crash
+
+                if n > snapshot_instance:
+                    apply_safely(self.state_machine, command)
+                    self.log_entries += 1
+                    instance_number = max(instance_number, n)
+
+        return instance_number
+
+
+    def _get_current_value(self):
+        if self.cached_value is None and self.state_machine is not None:
+            self.cached_value = self.state_machine.snapshot()
+        return self.cached_value
+
+    def _set_current_value(self, value):
+        # The state machine holds the value. Values other than None are full
+        # values that the state machine has been restored from.
+        if value is not None:
+            self.cached_value = value
+
+    current_value = property(_get_current_value, _set_current_value)
+
+    #--------------------------------------------------------------------------------
+    # Method Overrides
+    #
+    def load_state(self):
+        super(SnapshotStrategyMixin,self).load_state()
+
+        if self.snapshot_loaded:
+            return # Only load on the initial call from the constructor
+
+        self.snapshot_loaded = True
+
+        if os.path.exists(self.snapshot_file()):
+            snapshot_instance = self.state_machine.open_snapshot(self.snapshot_file())
+            self.cached_value = None
+        else:
+            # The state machine may have been restored from a state file that
+            # predates the use of snapshots
+            snapshot_instance = self.instance_number
+            self.write_snapshot(snapshot_instance)
+
+        instance_number = self.replay_log(snapshot_instance)
+
+        if instance_number > self.instance_number:
+            print 'RECOVERED: Advancing to instance', instance_number, 'from the snapshot and log'
+            self.cached_value = None
+            self.save_state(instance_number, None, None, None, None)
+
+
+    def save_state(self, instance_number, current_value, promised_id, accepted_id, accepted_value):
+        # The value is held by the snapshot and log
+        super(SnapshotStrategyMixin,self).save_state(instance_number, None, promised_id, accepted_id, accepted_value)
+
+
+    def apply_command(self, instance_number, command):
+        self.append_log(instance_number, command)
+
+        result = super(SnapshotStrategyMixin,self).apply_command(instance_number, command)
+
+        self.cached_value = None
+
+        if self.log_entries >= self.snapshot_interval:
+            self.write_snapshot(instance_number)
+
+        return result
+
+
+    def restore_state(self, instance_number, value):
+        super(SnapshotStrategyMixin,self).restore_state(instance_number, value)
+
+        self.write_snapshot(instance_number)
+
+        self.cached_value = value
+
+
+    def state_value(self):
+        return None # Encoded on demand by the current_value property
@@ -0,0 +1,126 @@
+# This module provides a Mixin class that replaces the opaque replicated value
+# with a deterministic state machine. Rather than replacing the current value,
+# each application-level link in the chain holds a command that every peer
+# applies to its local copy of the state machine in advance_instance. Reads are
+# answered by querying the state machine directly.
+#
+# State machines implement the following interface:
+#
+#    * apply(command)   - Applies a resolved command. Must be deterministic.
+#                         Returns a result that is printed for informational
+#                         purposes. Malformed commands should be rejected
+#                         before any change is made to the state.
+#    * query(request)   - Returns the result of a read-only request.
+#    * snapshot()       - Returns the full state encoded as a string.
+#    * restore(data)    - Replaces the full state with a decoded snapshot. The
+#                         data argument is None for an empty state.
+#
+# The snapshot is stored as the current value so the state file and catchup
+# messages always carry the full state.
+#
+# Commands are added to the chain as specially marked values. Other
+# application-level values are ignored since they cannot be applied to the state
+# machine. Commands that cannot be decoded, or that cause the state machine to
+# raise one of the errors typical of malformed input, are likewise ignored so
+# that every peer treats them as no-ops and the chain continues. This mixin must follow DedicatedMasterStrategyMixin in the
+# inheritance order so that it sees the decoded application-level values in
+# advance_instance.
+#
+import json
+
+from replicated_value import UNCHANGED
+
+
+# Values in the chain that begin with this prefix are state machine commands
+COMMAND_PREFIX = '\x00command '
+
+# Errors raised by state machines for malformed commands
+COMMAND_ERRORS = (ValueError, TypeError, KeyError, IndexError, AttributeError)
+
+
+def apply_safely(state_machine, command):
+    '''
+    Applies the command and returns the result. Malformed commands that cause
+    the state machine to raise are reported in the result instead.
+    '''
+    try:
+        return state_machine.apply(command)
+    except COMMAND_ERRORS, e:
+        return 'REJECTED. {0}: {1}'.format(type(e).__name__, e)
+
+
+class StateMachineMixin (object):
+
+    state_machine_class = None # Set by the concrete class
+
+    state_machine = None
+
+
+    def propose_command(self, command):
+        self.propose_update( COMMAND_PREFIX + json.dumps(command) )
+
+
+    def query_state(self, request):
+        '''
+        Returns a (instance_number, result, staleness) tuple in the same manner as
+        read_value()
+        '''
+        return self.instance_number, self.state_machine.query(request), self.staleness()
+
+
+    def apply_command(self, instance_number, command):
+        '''
+        Applies a resolved command that advances the chain to instance_number
+        '''
+        return apply_safely(self.state_machine, command)
+
+
+    def restore_state(self, instance_number, value):
+        '''
+        Replaces the state with that of a full value received in a catchup message
+        '''
+        self.state_machine.restore(value)
+
+
+    def state_value(self):
+        '''
+        Returns the current value to record after applying a command
+        '''
+        return self.state_machine.snapshot()
+
+    #--------------------------------------------------------------------------------
+    # Method Overrides
+    #
+    def load_state(self):
+        super(StateMachineMixin,self).load_state()
+
+        if self.state_machine is None:
+            # Only restore on the initial call from the constructor
+            self.state_machine = self.state_machine_class()
+            self.state_machine.restore( self.current_value )
+
+
+    def advance_instance(self, new_instance_number, new_current_value, catchup=False):
+        if catchup:
+            self.restore_state( new_instance_number, new_current_value )
+
+        elif isinstance(new_current_value, basestring) and new_current_value.startswith(COMMAND_PREFIX):
+            try:
+                command = json.loads( new_current_value[len(COMMAND_PREFIX):] )
+            except ValueError, e:
+                print 'IGNORING COMMAND. Unable to decode:', e
+                new_current_value = UNCHANGED
+            else:
+                result            = self.apply_command( new_instance_number, command )
+                new_current_value = self.state_value()
+
+                print '   Command Result:', result
+
+        elif new_current_value is not UNCHANGED:
+            # Comparing the value against the current value would require the
+            # state machine to be encoded
+            if new_current_value is not None:
+                print 'IGNORING VALUE. Only state machine commands may be added to the chain'
+            new_current_value = UNCHANGED
+
+        super(StateMachineMixin,self).advance_instance(new_instance_number, new_current_value, catchup=catchup)
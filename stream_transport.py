@@ -0,0 +1,253 @@
+# This module provides a reliable, stream-based alternative to UDP for messages
+# that are too large to fit in a single datagram. Each peer maintains at most
+# one outbound TCP connection to every other peer. Connections are established
+# on first use, kept open for subsequent messages, and automatically
+# re-established with an exponential backoff if they are lost.
+#
+# Messages are framed with a 4-byte, big-endian length prefix. The header and
+# payload are handed to the transport as a sequence so the payload is never
+# copied to prepend the header. The first frame sent over each connection is a
+# 'hello <uid>' message that identifies the sender to the accepting peer.
+#
+# As with UDP, delivery is best-effort from the perspective of the Paxos
+# implementation. Messages sent while a connection is being established are
+# held in a small, bounded queue and the oldest are discarded if the queue
+# overflows. Lost messages are recovered by the normal retransmission and
+# synchronization strategies.
+#
+# TCP sockets are listened for on the same port numbers as the UDP sockets.
+#
+import struct
+import collections
+
+import runtime
+
+
+HEADER = struct.Struct('>I')
+
+
+class FrameReceiver (object):
+    '''
+    Stream protocol that splits the incoming byte stream into length-prefixed
+    frames. Incoming data is accumulated in a list of chunks and joined only
+    once a complete frame is available so large frames that arrive in many
+    small pieces are not repeatedly copied.
+    '''
+
+    max_frame_size = 64 * 1024 * 1024
+
+    transport = None # Set by the runtime prior to calling connectionMade()
+
+    def __init__(self):
+        self.chunks   = list()
+        self.buffered = 0
+        self.needed   = HEADER.size
+        self.in_body  = False
+
+
+    def connectionMade(self):
+        pass
+
+
+    def connectionLost(self):
+        pass
+
+
+    def frameReceived(self, payload):
+        pass
+
+
+    def sendFrame(self, payload):
+        self.transport.writeSequence( [HEADER.pack(len(payload)), payload] )
+
+
+    def dataReceived(self, data):
+        self.chunks.append( data )
+        self.buffered += len(data)
+
+        if self.buffered < self.needed:
+            return
+
+        buf = self.chunks[0] if len(self.chunks) == 1 else ''.join(self.chunks)
+        pos = 0 # Offset of the first unconsumed byte in buf
+
+        while len(buf) - pos >= self.needed:
+            chunk = buf[pos:pos + self.needed]
+            pos  += self.needed
+
+            if self.in_body:
+                self.needed  = HEADER.size
+                self.in_body = False
+                self.frameReceived( chunk )
+            else:
+                self.needed  = HEADER.unpack(chunk)[0]
+                self.in_body = True
+
+                if self.needed > self.max_frame_size:
+                    print 'STREAM: Frame of {0} bytes exceeds the maximum. Dropping connection'.format(self.needed)
+                    self.chunks   = []
+                    self.buffered = 0
+                    self.needed   = HEADER.size
+                    self.transport.loseConnection()
+                    return
+
+        # The unconsumed remainder is copied once, after all complete frames
+        # have been extracted
+        rest          = buf[pos:]
+        self.chunks   = [rest] if rest else []
+        self.buffered = len(rest)
+
+
+
+class InboundConnection (FrameReceiver):
+    '''
+    Accepted connection. Frames received after the initial hello are passed to
+    the stream transport along with the UID of the sending peer.
+    '''
+
+    def __init__(self, stream):
+        FrameReceiver.__init__(self)
+        self.stream   = stream
+        self.peer_uid = None
+
+
+    def frameReceived(self, payload):
+        if self.peer_uid is not None:
+            self.stream.receive_fn(self.peer_uid, payload)
+
+        else:
+            message_type, _, uid = payload.partition(' ')
+
+            if message_type != 'hello' or not self.stream.is_known(uid):
+                print 'STREAM: Invalid hello message. Dropping connection'
+                self.transport.loseConnection()
+            else:
+                self.peer_uid = uid
+
+
+
+class OutboundConnection (FrameReceiver):
+    '''
+    Persistent connection to a single peer. Messages sent while the connection is
+    down are queued and flushed once it has been (re-)established.
+    '''
+
+    min_retry_delay = 0.05 # seconds
+    max_retry_delay = 5.0  # seconds
+    max_queued      = 64   # messages
+
+    def __init__(self, stream, peer_uid):
+        FrameReceiver.__init__(self)
+        self.stream      = stream
+        self.peer_uid    = peer_uid
+        self.connected   = False
+        self.connecting  = False
+        self.closing     = False # Set if disconnect() is called while connecting
+        self.retry_delay = self.min_retry_delay
+        self.retry_timer = None
+        self.queue       = collections.deque(maxlen=self.max_queued)
+
+
+    def send(self, payload):
+        if self.connected:
+            self.sendFrame( payload )
+        else:
+            self.queue.append( payload )
+            if not self.connecting and self.retry_timer is None:
+                self.connect()
+
+
+    def connect(self):
+        self.retry_timer = None
+        self.connecting  = True
+        host, port       = self.stream.addr_fn(self.peer_uid)
+        runtime.connect_tcp(host, port, self)
+
+
+    def connectionMade(self):
+        self.connecting  = False
+
+        if self.closing:
+            self.transport.loseConnection()
+            return
+
+        self.connected   = True
+        self.retry_delay = self.min_retry_delay
+
+        self.sendFrame( 'hello ' + self.stream.uid )
+
+        while self.queue:
+            self.sendFrame( self.queue.popleft() )
+
+
+    def connectionLost(self):
+        self.connecting = False
+        self.connected  = False
+        self.transport  = None
+
+        FrameReceiver.__init__(self) # discard any partially received frame
+
+        if self.queue and self.retry_timer is None and not self.closing:
+            self.retry_timer = runtime.call_later(self.retry_delay, self.connect)
+            self.retry_delay = min(self.retry_delay * 2, self.max_retry_delay)
+
+
+    def disconnect(self):
+        '''
+        Closes the connection, if any. Used when the address of the peer changes.
+        The next message sent will establish a new connection.
+        '''
+        self.queue.clear()
+
+        if self.retry_timer is not None:
+            self.retry_timer.cancel()
+            self.retry_timer = None
+
+        if self.connected:
+            self.transport.loseConnection()
+        elif self.connecting:
+            # The pending connection attempt cannot be cancelled through the
+            # runtime so it is closed as soon as it completes
+            self.closing = True
+
+
+
+class StreamTransport (object):
+    '''
+    Manages the listening socket and the pool of outbound peer connections.
+    receive_fn(from_uid, packet) is called for each message received from a
+    peer. addr_fn(uid) returns the (ip, port) address of a peer and is also used
+    to validate the UIDs of peers that connect to this one.
+    '''
+
+    def __init__(self, uid, port, receive_fn, addr_fn):
+        self.uid         = uid
+        self.receive_fn  = receive_fn
+        self.addr_fn     = addr_fn
+        self.connections = dict() # peer uid => OutboundConnection
+
+        runtime.listen_tcp( port, lambda : InboundConnection(self) )
+
+
+    def is_known(self, uid):
+        try:
+            self.addr_fn(uid)
+            return True
+        except KeyError:
+            return False
+
+
+    def send(self, to_uid, packet):
+        c = self.connections.get(to_uid)
+
+        if c is None:
+            c = OutboundConnection(self, to_uid)
+            self.connections[to_uid] = c
+
+        c.send( packet )
+
+
+    def address_changed(self, uid):
+        c = self.connections.pop(uid, None)
+        if c is not None:
+            c.disconnect()
@@ -5,7 +5,7 @@
 #
 import random
 
-from twisted.internet import task
+import runtime
 
 class SimpleSynchronizationStrategyMixin (object):
     
@@ -15,10 +15,13 @@ class SimpleSynchronizationStrategyMixin (object):
         super(SimpleSynchronizationStrategyMixin,self).set_messenger(messenger)
 
         def sync():
-            self.messenger.send_sync_request(random.choice(self.peers), self.instance_number)
+            # Requests sent to this peer would be wasted. This matters most for
+            # the request sent immediately at startup.
+            others = [ uid for uid in self.peers if uid != self.network_uid ]
+            if others:
+                self.messenger.send_sync_request(random.choice(others), self.instance_number)
                 
-        self.sync_task = task.LoopingCall(sync)
-        self.sync_task.start(self.sync_delay)
+        self.sync_task = runtime.looping_call(self.sync_delay, sync)
 
         
     def receive_sync_request(self, from_uid, instance_number):
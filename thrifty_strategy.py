@@ -0,0 +1,133 @@
+# This module provides a Mixin class that implements 'thrifty' Accept
+# messaging. Rather than sending each Accept message to every peer, the
+# proposer sends it to only as many peers as are needed to form a phase 2
+# quorum and selects the peers that have recently responded most quickly. If
+# the instance is not resolved within the thrifty_timeout, the Accept is sent
+# to the remaining peers as well. For larger peer groups, this reduces the
+# bandwidth used by the proposer and the number of acceptors that must process
+# and save each value, without slowing resolution in the common case.
+#
+# The response latency of each peer is measured from the time an Accept is sent
+# to it until its Accepted message arrives, and is smoothed with an
+# exponentially weighted moving average. Peers that have not yet been measured
+# are preferred so that every peer is measured at least once. Peers that fail
+# to respond before the timeout have their estimates doubled, and raised to at
+# least the timeout, so that they are passed over for subsequent instances.
+# Every probe_interval'th Accept is sent to all peers so that the estimates of
+# peers that are passed over remain current and recovered peers are selected
+# again.
+#
+# Acceptors continue to send their Accepted messages to all peers so every peer
+# learns of the resolution, including those that were not sent the Accept.
+#
+# This mixin must follow ExponentialBackoffResolutionStrategyMixin in the
+# inheritance order so that retransmissions of the Accept message are sent to
+# all peers.
+#
+import time
+
+import runtime
+
+
+class ThriftyAcceptStrategyMixin (object):
+
+    thrifty         = False # Set to True to enable thrifty Accept messaging
+    thrifty_timeout = 50    # milliseconds
+    latency_weight  = 0.25  # Weight given to each new latency measurement
+    probe_interval  = 100   # Number of Accepts between those sent to all peers
+
+    peer_latency    = None  # peer_uid => smoothed response latency in seconds
+    thrifty_key     = None  # (instance_number, proposal_id) of the most recent Accept
+    accept_sent_at  = None  # peer_uid => time at which the most recent Accept was sent to it
+    thrifty_widen   = None
+    accept_count    = 0
+
+
+    def fastest_quorum(self):
+        '''
+        Returns the accept_quorum_size peers with the lowest response latencies
+        '''
+        if self.peer_latency is None:
+            self.peer_latency = dict()
+
+        ranked = sorted(self.peers, key = lambda uid: self.peer_latency.get(uid, -1.0))
+
+        return ranked[:self.accept_quorum_size]
+
+
+    def send_accept_to(self, uids, proposal_id, proposal_value):
+        now = time.time()
+        for uid in uids:
+            self.accept_sent_at[uid] = now
+            self.messenger.send_accept(uid, self.instance_number, proposal_id, proposal_value)
+
+
+    def widen_accept(self, key, proposal_id, proposal_value):
+        '''
+        Called when the thrifty quorum has not resolved the instance within the
+        timeout. Sends the Accept to the remaining peers.
+        '''
+        if key != self.thrifty_key:
+            return
+
+        timeout = self.thrifty_timeout/1000.0
+
+        for uid, sent_at in self.accept_sent_at.iteritems():
+            if sent_at is not None:
+                self.peer_latency[uid] = max(2 * self.peer_latency.get(uid, 0.0), timeout)
+
+        self.send_accept_to([ uid for uid in self.peers if uid not in self.accept_sent_at ],
+                            proposal_id, proposal_value)
+
+
+    def cancel_widen(self):
+        if self.thrifty_widen is not None and self.thrifty_widen.active():
+            self.thrifty_widen.cancel()
+        self.thrifty_widen = None
+
+    #--------------------------------------------------------------------------------
+    # Method Overrides
+    #
+    def send_accept(self, proposal_id, proposal_value):
+        key = (self.instance_number, proposal_id)
+
+        if not self.thrifty or key == self.thrifty_key:
+            # Retransmissions are sent to all peers
+            super(ThriftyAcceptStrategyMixin,self).send_accept(proposal_id, proposal_value)
+            return
+
+        self.cancel_widen()
+
+        self.thrifty_key    = key
+        self.accept_sent_at = dict()
+        self.accept_count  += 1
+
+        if self.accept_count % self.probe_interval == 0:
+            self.send_accept_to(self.peers, proposal_id, proposal_value)
+            return
+
+        self.send_accept_to(self.fastest_quorum(), proposal_id, proposal_value)
+
+        self.thrifty_widen = runtime.call_later(self.thrifty_timeout/1000.0, self.widen_accept,
+                                                key, proposal_id, proposal_value)
+
+
+    def advance_instance(self, new_instance_number, new_current_value, catchup=False):
+        self.cancel_widen()
+
+        super(ThriftyAcceptStrategyMixin,self).advance_instance(new_instance_number, new_current_value, catchup=catchup)
+
+
+    def receive_accepted(self, from_uid, instance_number, proposal_id, proposal_value):
+        if (instance_number, proposal_id) == self.thrifty_key and self.accept_sent_at.get(from_uid) is not None:
+            latency = time.time() - self.accept_sent_at[from_uid]
+            prior   = self.peer_latency.get(from_uid)
+
+            if prior is None:
+                self.peer_latency[from_uid] = latency
+            else:
+                self.peer_latency[from_uid] = prior + self.latency_weight * (latency - prior)
+
+            self.accept_sent_at[from_uid] = None # Only the first response is measured
+
+        super(ThriftyAcceptStrategyMixin,self).receive_accepted(from_uid, instance_number, proposal_id, proposal_value)
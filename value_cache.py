@@ -0,0 +1,87 @@
+# This module provides a content-addressed cache of replicated values that is
+# used by the Messenger to avoid repeatedly sending large values to the same
+# peer. The same value is typically carried by an Accept message, by every
+# peer's Accepted messages, by Promise messages, by each retransmission, and by
+# catchup messages. Once a peer is known to hold a value, subsequent messages
+# sent to it carry only the hash of the value.
+#
+# Each entry records the set of peers known to hold the value. A peer is
+# assumed to hold a value once the value has been sent to it or received from
+# it. If a peer receives a hash that it does not have a value for, it requests
+# the value from the sender. The cache is bounded and the least recently used
+# entries are evicted first.
+#
+import hashlib
+import collections
+
+
+class ValueCache (object):
+
+    def __init__(self, max_entries=128, min_size=256):
+        '''
+        Values shorter than min_size bytes are not worth replacing with a hash
+        and are always sent in full.
+        '''
+        self.max_entries = max_entries
+        self.min_size    = min_size
+        self.entries     = collections.OrderedDict() # key => [value, set(peer_uids)]
+        self.last_value  = None
+        self.last_key    = None
+
+
+    def cacheable(self, value):
+        return value is not None and len(value) >= self.min_size
+
+
+    def key_of(self, value):
+        # The same value object is commonly sent to every peer in turn so the
+        # most recent hash is remembered to avoid recomputing it.
+        if value is not self.last_value:
+            data            = value.encode('utf-8') if isinstance(value, unicode) else value
+            self.last_key   = hashlib.sha256(data).hexdigest()
+            self.last_value = value
+        return self.last_key
+
+
+    def add(self, value, peer_uid=None):
+        '''
+        Adds the value to the cache, if it is not already present, and returns its
+        key. If peer_uid is provided, the peer is recorded as holding the value.
+        '''
+        key = self.key_of(value)
+        e   = self.entries.pop(key, None)
+
+        if e is None:
+            e = [value, set()]
+            if len(self.entries) >= self.max_entries:
+                self.entries.popitem(last=False)
+
+        self.entries[key] = e
+
+        if peer_uid is not None:
+            e[1].add(peer_uid)
+
+        return key
+
+
+    def get(self, key, peer_uid=None):
+        '''
+        Returns the value for the key or None if it is not cached. If peer_uid is
+        provided, the peer is recorded as holding the value.
+        '''
+        e = self.entries.pop(key, None)
+
+        if e is None:
+            return None
+
+        self.entries[key] = e
+
+        if peer_uid is not None:
+            e[1].add(peer_uid)
+
+        return e[0]
+
+
+    def peer_has(self, key, peer_uid):
+        e = self.entries.get(key)
+        return e is not None and peer_uid in e[1]